@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+# Admission control for OCR work. A job needs one slot and its estimated
+# memory (pages x rasterized page size) to start; jobs that don't fit wait in
+# a bounded FIFO queue, and anything beyond the queue (or waiting too long)
+# is rejected with 429 + Retry-After instead of piling page images into RAM.
+
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+OCR_MEMORY_BUDGET_MB = int(os.getenv("OCR_MEMORY_BUDGET_MB", "1024"))
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "16"))
+OCR_MAX_WAIT = float(os.getenv("OCR_MAX_WAIT", "30"))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))  # pdf2image's default
+
+# Letter-size page. Pages are rasterized to 8-bit grayscale and thresholded in
+# place (see ocr_engine.py); the second byte covers pytesseract's PIL copy
+PAGE_WIDTH_IN, PAGE_HEIGHT_IN = 8.5, 11
+BYTES_PER_PIXEL = 2
+
+
+def count_pdf_pages(pdf_path):
+    try:
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
+    except Exception:
+        # No poppler (or a damaged file): count page objects directly
+        with open(pdf_path, "rb") as f:
+            return max(1, len(re.findall(rb"/Type\s*/Page(?!s)", f.read())))
+
+
+def estimate_ocr_bytes(pdf_path, dpi=OCR_DPI):
+    pixels = (PAGE_WIDTH_IN * dpi) * (PAGE_HEIGHT_IN * dpi)
+    return int(count_pdf_pages(pdf_path) * pixels * BYTES_PER_PIXEL)
+
+
+class OcrAdmission:
+    def __init__(self, slots=OCR_MAX_CONCURRENCY, memory_budget=OCR_MEMORY_BUDGET_MB * 1024 * 1024,
+                 max_queue=OCR_MAX_QUEUE, max_wait=OCR_MAX_WAIT):
+        self.slots = slots
+        self.memory_budget = memory_budget
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._running = 0
+        self._memory_in_use = 0
+        self._waiters = []  # FIFO of (cost, future)
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.last_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._avg_job_seconds = 5.0
+
+    def _fits(self, cost):
+        return self._running < self.slots and self._memory_in_use + cost <= self.memory_budget
+
+    def _retry_after(self):
+        """Seconds until the queue ahead of a new request would likely drain"""
+        backlog = len(self._waiters) + self._running
+        return max(1, int(self._avg_job_seconds * backlog / self.slots + 0.5))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"OCR is at capacity ({reason}). Retry later.",
+            headers={"Retry-After": str(self._retry_after())}
+        )
+
+    def _wake_waiters(self):
+        # Strict FIFO: a big job at the head is not starved by smaller ones behind it
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, future = self._waiters.pop(0)
+            if future.done():
+                continue
+            self._running += 1
+            self._memory_in_use += cost
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, cost_bytes):
+        # A document bigger than the whole budget may still run, alone
+        cost = min(cost_bytes, self.memory_budget)
+        started = time.perf_counter()
+
+        if not self._waiters and self._fits(cost):
+            self._running += 1
+            self._memory_in_use += cost
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue full")
+            future = asyncio.get_running_loop().create_future()
+            entry = (cost, future)
+            self._waiters.append(entry)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                if not future.done():
+                    self._reject("queue wait timed out")
+                # Admitted just as the timeout fired; keep the slot
+            except asyncio.CancelledError:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                elif future.done():
+                    self._release(cost)
+                raise
+
+        wait_ms = (time.perf_counter() - started) * 1000
+        self.admitted += 1
+        self.last_wait_ms = wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+        job_started = time.perf_counter()
+        try:
+            yield {"queue_wait_ms": round(wait_ms, 2)}
+        finally:
+            elapsed = time.perf_counter() - job_started
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+            self._release(cost)
+
+    def _release(self, cost):
+        self._running -= 1
+        self._memory_in_use -= cost
+        self._wake_waiters()
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "slots": self.slots,
+            "memory_in_use_mb": round(self._memory_in_use / 1024 / 1024, 1),
+            "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "last_wait_ms": round(self.last_wait_ms, 2),
+            "max_wait_ms": round(self.max_wait_ms, 2),
+        }
@@ -0,0 +1,223 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+# Offline benchmarks: main.py routes run in-process against mongomock-motor
+# and an eth-tester EVM running the CarbonToken bytecode from the frontend
+# artifact, so no Atlas cluster, node or server is needed.
+#
+#   pip install -r requirements_bench.txt
+#   cd backend && pytest benchmarks                      # run and compare with baseline.json
+#   cd backend && pytest benchmarks --save-baseline      # record a new baseline
+#
+# Every benchmark reports throughput (ops/s) and p50/p99. A p50 or p99 more
+# than --regression-tolerance above the baseline fails the run, unless it grew
+# by less than --regression-floor-ms: sub-millisecond routes jitter by more
+# than 25% from run to run.
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("httpx")
+pytest.importorskip("mongomock_motor")
+pytest.importorskip("eth_tester")
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+from web3 import Web3, EthereumTesterProvider
+from eth_tester import EthereumTester, PyEVMBackend
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARTIFACT_PATH = os.path.join(BACKEND_DIR, "..", "frontend", "src", "abis", "CarbonToken.json")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SEED_COMPANIES = 200
+SEED_LISTINGS = 25
+SEED_HISTORY_EVENTS = 1000
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("carbon benchmarks")
+    group.addoption("--save-baseline", action="store_true",
+                    help="Write this run's p50/p99/ops to benchmarks/baseline.json")
+    group.addoption("--regression-tolerance", type=float, default=0.25,
+                    help="Allowed p50/p99 growth over the baseline (0.25 = 25%%)")
+    group.addoption("--regression-floor-ms", type=float, default=1.0,
+                    help="p50/p99 growth below this many ms is never a regression")
+
+
+def percentile(sorted_data, pct):
+    index = min(len(sorted_data) - 1, int(round(pct / 100 * (len(sorted_data) - 1))))
+    return sorted_data[index]
+
+
+def summarize(bench):
+    data = sorted(bench.stats.data)
+    return {
+        "ops": round(1 / bench.stats.mean, 2),
+        "p50_ms": round(percentile(data, 50) * 1000, 3),
+        "p99_ms": round(percentile(data, 99) * 1000, 3),
+        "rounds": len(data),
+    }
+
+
+def _finished_benchmarks(config):
+    session = getattr(config, "_benchmarksession", None)
+    return [bench for bench in (session.benchmarks if session else []) if bench]
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    for entry, bench in zip(output_json["benchmarks"], benchmarks):
+        entry["extra_info"].update(summarize(bench))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    results = {bench.fullname: summarize(bench) for bench in _finished_benchmarks(config)}
+    if not results:
+        return
+
+    if config.getoption("--save-baseline"):
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        config._bench_report = (results, {}, [])
+        return
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    tolerance = config.getoption("--regression-tolerance")
+    floor_ms = config.getoption("--regression-floor-ms")
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if result[key] > before[key] * (1 + tolerance) and result[key] - before[key] >= floor_ms:
+                regressions.append(f"{name} {key}: {before[key]} -> {result[key]}")
+    config._bench_report = (results, baseline, regressions)
+    if regressions:
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    report = getattr(config, "_bench_report", None)
+    if not report:
+        return
+    results, baseline, regressions = report
+    terminalreporter.section("throughput and latency percentiles")
+    for name, result in sorted(results.items()):
+        line = f"{name:<70} {result['ops']:>10.2f} ops/s  p50 {result['p50_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms"
+        before = baseline.get(name)
+        if before:
+            line += f"  (baseline p50 {before['p50_ms']} / p99 {before['p99_ms']})"
+        terminalreporter.write_line(line)
+    if config.getoption("--save-baseline"):
+        terminalreporter.write_line(f"📝 Baseline saved to {BASELINE_PATH}")
+    for regression in regressions:
+        terminalreporter.write_line(f"❌ Regression: {regression}", red=True)
+
+
+# --- STAND-INS ---
+
+@pytest.fixture(scope="session")
+def chain():
+    """eth-tester EVM with CarbonToken deployed; account 0 is the owner"""
+    backend = PyEVMBackend()
+    w3 = Web3(EthereumTesterProvider(EthereumTester(backend)))
+    keys = [key.to_hex() for key in backend.account_keys]
+
+    with open(ARTIFACT_PATH) as f:
+        artifact = json.load(f)
+    factory = w3.eth.contract(abi=artifact["abi"], bytecode=artifact["bytecode"])
+    owner = w3.eth.account.from_key(keys[0]).address
+    receipt = w3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": owner}))
+    return w3, keys, receipt.contractAddress, artifact["abi"]
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def app(chain, loop, tmp_path_factory):
+    """main.py wired to the local chain and an in-memory Mongo, with the lifespan running"""
+    w3, keys, address, abi = chain
+    os.environ.update({
+        "PRIVATE_KEY": keys[0],
+        "TESLA_PRIVATE_KEY": keys[1],
+        "TWITCH_PRIVATE_KEY": keys[2],
+        "CONTRACT_ADDRESS": address,
+    })
+    os.chdir(BACKEND_DIR)
+    import main
+
+    main.w3 = w3
+    main.contract = w3.eth.contract(address=address, abi=abi)
+    main.fee_oracle.w3 = w3
+    main.read_cache.w3 = w3
+
+    mongo = AsyncMongoMockClient()
+    main.client = mongo
+    main.db = mongo.carbon_cred_db
+    for name in dir(main):
+        if name.endswith("_col"):
+            setattr(main, name, main.db.get_collection(getattr(main, name).name))
+    main.history_writer.collection = main.history_col
+    main.history_writer.journal_path = str(tmp_path_factory.mktemp("history") / "history.journal")
+    main.idempotency.collection = main.db.get_collection("idempotency_keys")
+    main.ocr_queue.collection = main.db.get_collection("ocr_tasks")
+
+    lifespan = main.lifespan(main.app)
+    loop.run_until_complete(lifespan.__aenter__())
+    loop.run_until_complete(seed(main, w3, keys))
+    yield main
+    loop.run_until_complete(lifespan.__aexit__(None, None, None))
+
+
+async def seed(main, w3, keys):
+    tesla = w3.eth.account.from_key(keys[1]).address
+    twitch = w3.eth.account.from_key(keys[2]).address
+    await main.mint_carbon_credits(tesla, 10_000)
+    await main.mint_carbon_credits(twitch, 10_000)
+
+    await main.companies_col.insert_many([
+        {"name": f"COMPANY_{i}", "wallet_address": f"0x{i:040x}", "initial_allowance": 1000 + i,
+         "last_verified_consumption": 900 + (i * 7) % 300, "status": "active"}
+        for i in range(SEED_COMPANIES)
+    ])
+    await main.companies_col.insert_many([
+        {"name": "TESLA", "wallet_address": tesla.lower(), "initial_allowance": 10_000, "status": "active"},
+        {"name": "TWITCH", "wallet_address": twitch.lower(), "initial_allowance": 10_000, "status": "active"},
+    ])
+
+    for i in range(SEED_LISTINGS):
+        response = await main._list_with_price("TESLA", 10, 5 + i % 7, f"upi://pay?tn={i}")
+        assert response["status"] == "LISTED", response
+
+    for i in range(SEED_HISTORY_EVENTS):
+        main.history_writer.record({
+            "timestamp": main.datetime.utcnow(), "type": "MARKETPLACE_LIST",
+            "company": "TESLA", "companies": ["TESLA"], "amount": 1, "price": 5, "listing_id": i
+        })
+    await main.history_writer.flush()
+
+
+@pytest.fixture(scope="session")
+def client(app, loop):
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bench")
+    yield client
+    loop.run_until_complete(client.aclose())
+
+
+@pytest.fixture(scope="session")
+def call(client, loop):
+    """call("GET", "/leaderboard", params=...) -> httpx.Response, run on the session loop"""
+    def call(method, path, **kwargs):
+        return loop.run_until_complete(client.request(method, path, **kwargs))
+    return call
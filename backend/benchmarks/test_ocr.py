@@ -0,0 +1,36 @@
+import os
+import shutil
+
+import pytest
+
+# extract_carbon_result on the sample PDFs shipped in backend/ (e.pdf is plain
+# text, not a PDF, so it isn't one of them). Each document's figure is its
+# total or allowance; reports also list line items, which must not win.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KNOWN_VALUES = {
+    "audit2.pdf": 700.0,             # total of the 450 + 150 + 100 tons line items
+    "audit_report.pdf": 600.0,       # TOTAL CARBON EMISSIONS: 600.0 tons
+    "test2.pdf": 500.0,              # ALLOWANCE: 500.0 tons
+    "test_registration.pdf": 500.0,  # Verified Carbon Allowance: 500
+    "test_report.pdf": 750.0,        # Total Historical Carbon Footprint: 750.0 tons
+    "twitch.pdf": 500.0,             # Verified Carbon Allowance: 500
+    "twitch_audit.pdf": 600.0,       # Emissions: 600 tons
+}
+
+pytestmark = pytest.mark.skipif(
+    not (shutil.which("pdftoppm") and shutil.which("tesseract")),
+    reason="OCR benchmarks need poppler (pdftoppm) and tesseract on PATH"
+)
+
+
+@pytest.mark.parametrize("pdf", sorted(KNOWN_VALUES))
+def test_extract_carbon_result(benchmark, pdf):
+    pytest.importorskip("pytesseract")
+    pytest.importorskip("pdf2image")
+    from ocr_engine import extract_carbon_result
+
+    path = os.path.join(BACKEND_DIR, pdf)
+    result = benchmark.pedantic(extract_carbon_result, args=(path,), rounds=5, iterations=1, warmup_rounds=1)
+    assert result is not None, f"No carbon figure read from {pdf}"
+    assert result.value == KNOWN_VALUES[pdf], f"{pdf}: read {result.value} from {result.text!r}"
@@ -0,0 +1,61 @@
+import shutil
+import itertools
+
+import pytest
+
+# Route benchmarks; fixtures and seeding live in conftest.py
+
+
+def test_leaderboard(benchmark, call):
+    response = benchmark(call, "GET", "/leaderboard")
+    assert response.status_code == 200
+    assert len(response.json()["leaderboard"]) >= 200
+
+
+def test_marketplace_listings(benchmark, call):
+    response = benchmark(call, "GET", "/marketplace/listings")
+    assert response.json()["status"] == "SUCCESS"
+    assert len(response.json()["listings"]) >= 25
+
+
+def test_order_book_cheapest(benchmark, call):
+    response = benchmark(call, "GET", "/marketplace/order-book", params={"limit": 10})
+    assert response.status_code == 200
+
+
+def test_order_book_fill(benchmark, call):
+    response = benchmark(call, "GET", "/marketplace/order-book/fill", params={"amount": 120})
+    assert response.status_code == 200
+
+
+def test_history_page(benchmark, call):
+    response = benchmark(call, "GET", "/history", params={"company": "TESLA", "limit": 100})
+    assert response.json()["status"] == "SUCCESS"
+
+
+def test_list_with_price(benchmark, call):
+    """One signed transaction + receipt + history record per round"""
+    counter = itertools.count()
+
+    def list_one():
+        return call("POST", "/marketplace/list-with-price", params={
+            "company_name": "TESLA", "amount": 1, "price": 5, "qr_url": f"upi://bench/{next(counter)}"
+        })
+
+    response = benchmark.pedantic(list_one, rounds=20, iterations=1)
+    assert response.json()["status"] == "LISTED"
+
+
+@pytest.mark.skipif(not (shutil.which("pdftoppm") and shutil.which("tesseract")),
+                    reason="Phase 1 needs poppler and tesseract to read the upload")
+def test_phase1_minting(benchmark, call):
+    """Upload, OCR (behind admission control), mint and upsert per round"""
+    with open("test2.pdf", "rb") as f:
+        pdf = f.read()
+
+    def mint_one():
+        return call("POST", "/phase1-minting/BENCH", params={"wallet_address": "0x" + "ab" * 20},
+                    files={"file": ("bench.pdf", pdf, "application/pdf")})
+
+    response = benchmark.pedantic(mint_one, rounds=10, iterations=1)
+    assert response.json()["status"] == "SUCCESS"
@@ -1,11 +1,11 @@
 import os
 import json
-from web3 import Web3
 from dotenv import load_dotenv
+from rpc_provider import make_web3
 
 # 1. Setup & Environment
 load_dotenv()
-w3 = Web3(Web3.HTTPProvider("http://127.0.0.1:8545"))
+w3 = make_web3()
 
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
 
@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import threading
+
+import logs
+
+# Transaction fee and gas-limit helpers, so building a transaction costs no
+# extra RPCs:
+#   - FeeOracle caches EIP-1559 fees (or a legacy gasPrice on pre-London
+#     chains) and refreshes them in the background.
+#   - GasEstimator caches estimate_gas per contract method and argument shape.
+#   - The chain ID is fetched once at startup, or pinned with CHAIN_ID. Only a
+#     pinned ID protects against a node on the wrong chain (see main.py's
+#     validate_contract); set it in production.
+
+FEE_REFRESH_INTERVAL = float(os.getenv("FEE_REFRESH_INTERVAL", "5"))
+FEE_TTL = float(os.getenv("FEE_TTL", "15"))
+MIN_PRIORITY_FEE_WEI = int(os.getenv("MIN_PRIORITY_FEE_WEI", str(10**9)))
+GAS_MARGIN = float(os.getenv("GAS_MARGIN", "1.2"))
+# Flat headroom on top of the ratio: one zero->nonzero SSTORE (20k) plus cold
+# access. Estimates cached for one caller must still fit a first-time caller.
+GAS_HEADROOM = int(os.getenv("GAS_HEADROOM", "25000"))
+
+log = logs.get_logger("fees")
+
+
+class FeeOracle:
+    def __init__(self, w3, refresh_interval=FEE_REFRESH_INTERVAL, ttl=FEE_TTL):
+        self.w3 = w3
+        self.refresh_interval = refresh_interval
+        self.ttl = ttl
+        self._chain_id = int(os.getenv("CHAIN_ID")) if os.getenv("CHAIN_ID") else None
+        self.chain_id_pinned = self._chain_id is not None
+        self._fees = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._task = None
+
+    @property
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def refresh(self):
+        """One fee_history call gives both the next base fee and recent tips"""
+        try:
+            history = self.w3.eth.fee_history(1, "latest", [50])
+            next_base_fee = history["baseFeePerGas"][-1]
+        except Exception:
+            next_base_fee = 0
+
+        if next_base_fee:
+            tip = max(history["reward"][0][0] if history.get("reward") else 0, MIN_PRIORITY_FEE_WEI)
+            fees = {
+                "maxPriorityFeePerGas": tip,
+                # Survives several consecutive full blocks of base-fee growth
+                "maxFeePerGas": 2 * next_base_fee + tip,
+            }
+        else:
+            fees = {"gasPrice": self.w3.eth.gas_price}
+
+        with self._lock:
+            self._fees = fees
+            self._fetched_at = time.monotonic()
+        return fees
+
+    def current(self):
+        with self._lock:
+            fresh = self._fees is not None and time.monotonic() - self._fetched_at < self.ttl
+            fees = self._fees
+        return dict(fees) if fresh else self.refresh()
+
+    async def start(self):
+        """Keeps fees fresh in the background, then fetches the chain ID and first fees.
+        The loop runs even if this first fetch raises, so the oracle recovers on its own."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        await asyncio.to_thread(lambda: (self.chain_id, self.refresh()))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                log.warning("Fee refresh failed", extra={"error": str(e)})
+
+
+def _arg_shape(value):
+    """Gas depends on argument types and encoded sizes, not on values"""
+    if isinstance(value, (str, bytes)):
+        return (type(value).__name__, (len(value) + 31) // 32)  # ABI words
+    if isinstance(value, (list, tuple)):
+        return ("list", tuple(_arg_shape(v) for v in value))
+    return type(value).__name__
+
+
+class GasEstimator:
+    def __init__(self, margin=GAS_MARGIN, headroom=GAS_HEADROOM):
+        self.margin = margin
+        self.headroom = headroom
+        self._limits = {}
+
+    def _key(self, contract_fn):
+        return (contract_fn.address, contract_fn.fn_name, tuple(_arg_shape(a) for a in contract_fn.args))
+
+    def peek(self, contract_fn, default=None):
+        return self._limits.get(self._key(contract_fn), default)
+
+    def gas_for(self, contract_fn, sender):
+        key = self._key(contract_fn)
+        limit = self._limits.get(key)
+        if limit is None:
+            estimate = contract_fn.estimate_gas({"from": sender})
+            limit = self._limits[key] = int(estimate * self.margin) + self.headroom
+        return limit
@@ -0,0 +1,180 @@
+import base64
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Read side of transaction_history: indexes, keyset-paginated queries and
+# daily rollups. Rollups are maintained incrementally from the batches the
+# HistoryWriter flushes, so dashboards never scan raw history.
+
+HISTORY_TYPES = ("MARKETPLACE_LIST", "MARKETPLACE_MARK_PAID", "MARKETPLACE_RELEASE")
+MAX_PAGE_SIZE = 500
+DUPLICATE_KEY = 11000
+
+
+async def ensure_indexes(history_col, rollups_col):
+    """Compound indexes matching every filter + the (timestamp, _id) sort key"""
+    await history_col.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await history_col.create_index([("companies", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await history_col.create_index([("type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await history_col.create_index([("listing_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    await rollups_col.create_index([("day", ASCENDING), ("type", ASCENDING)], unique=True)
+
+
+async def backfill_companies(history_col):
+    """Gives events written before the 'companies' array existed one built from
+    company / seller_company / buyer_company, so the company filter finds them"""
+    result = await history_col.update_many(
+        {"companies": {"$exists": False}},
+        [{"$set": {"companies": {"$setUnion": [{"$filter": {
+            "input": ["$company", "$seller_company", "$buyer_company"],
+            "cond": {"$ne": ["$$this", None]},
+        }}]}}}]
+    )
+    return result.modified_count
+
+
+def normalize_type(event_type):
+    """Accepts both 'MARKETPLACE_RELEASE' and the short 'RELEASE'"""
+    event_type = event_type.upper()
+    if not event_type.startswith("MARKETPLACE_"):
+        event_type = f"MARKETPLACE_{event_type}"
+    if event_type not in HISTORY_TYPES:
+        raise ValueError(f"Unknown history type {event_type}. Expected one of {', '.join(HISTORY_TYPES)}")
+    return event_type
+
+
+# --- CURSORS ---
+def encode_cursor(doc):
+    raw = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, oid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(oid)
+    except Exception:
+        raise ValueError("Malformed cursor")
+
+
+# --- QUERIES ---
+def build_query(company=None, event_type=None, listing_id=None, start=None, end=None, cursor=None):
+    query = {}
+    if company:
+        query["companies"] = company
+    if event_type:
+        query["type"] = normalize_type(event_type)
+    if listing_id is not None:
+        query["listing_id"] = listing_id
+
+    time_range = {}
+    if start:
+        time_range["$gte"] = start
+    if end:
+        time_range["$lt"] = end
+    if time_range:
+        query["timestamp"] = time_range
+
+    if cursor:
+        # Keyset: everything strictly "older" than the last row of the previous page
+        timestamp, oid = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": oid}},
+        ]}]}
+    return query
+
+
+async def query_history(history_col, limit=50, **filters):
+    """Returns one page of events (newest first) and the cursor for the next page"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = history_col.find(build_query(**filters)).sort(
+        [("timestamp", DESCENDING), ("_id", DESCENDING)]
+    ).limit(limit + 1)
+
+    events = [doc async for doc in cursor]
+    next_cursor = encode_cursor(events[limit - 1]) if len(events) > limit else None
+    events = events[:limit]
+    for doc in events:
+        doc["_id"] = str(doc["_id"])
+    return events, next_cursor
+
+
+# --- DAILY ROLLUPS ---
+def _day(timestamp):
+    return timestamp.strftime("%Y-%m-%d")
+
+
+# Recent batch ids kept on each rollup document to make re-applying a batch a no-op
+ROLLUP_BATCH_MEMORY = 500
+
+
+async def apply_rollups(rollups_col, events, batch_id):
+    """Folds a flushed batch into per-(day, type) counters with one bulk write.
+    Safe to retry: a (day, type) document that already lists batch_id is skipped."""
+    deltas = {}
+    for event in events:
+        if not isinstance(event.get("timestamp"), datetime) or not event.get("type"):
+            continue
+        key = (_day(event["timestamp"]), event["type"])
+        delta = deltas.setdefault(key, {"count": 0, "volume": 0, "priced_value": 0, "priced_volume": 0})
+        amount = event.get("amount") or 0
+        delta["count"] += 1
+        delta["volume"] += amount
+        if event.get("price") is not None:
+            # Weighted by amount: a 1000-token listing counts more than a 1-token one
+            delta["priced_value"] += event["price"] * amount
+            delta["priced_volume"] += amount
+
+    if not deltas:
+        return
+    ops = [
+        UpdateOne(
+            {"_id": f"{day}:{event_type}", "batches": {"$ne": batch_id}},
+            {"$inc": delta, "$setOnInsert": {"day": day, "type": event_type},
+             "$push": {"batches": {"$each": [batch_id], "$slice": -ROLLUP_BATCH_MEMORY}}},
+            upsert=True,
+        )
+        for (day, event_type), delta in deltas.items()
+    ]
+    # A duplicate _id means either the document already lists batch_id, or
+    # another worker inserted it first. Once more, with the document in place,
+    # the batches filter tells the two apart; a second duplicate is the first case.
+    for _ in range(2):
+        try:
+            await rollups_col.bulk_write(ops, ordered=False)
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            ops = [ops[err["index"]] for err in errors]
+
+
+async def query_rollups(rollups_col, start=None, end=None, event_type=None):
+    query = {}
+    if event_type:
+        query["type"] = normalize_type(event_type)
+    day_range = {}
+    if start:
+        day_range["$gte"] = _day(start)
+    if end:
+        # end is exclusive, like /history
+        day_range["$lte"] = _day(end - timedelta(microseconds=1))
+    if day_range:
+        query["day"] = day_range
+
+    rollups = []
+    async for doc in rollups_col.find(query).sort([("day", ASCENDING), ("type", ASCENDING)]):
+        rollups.append({
+            "day": doc["day"],
+            "type": doc["type"],
+            "count": doc.get("count", 0),
+            "volume": doc.get("volume", 0),
+            # Volume-weighted; None for days rolled up before weighting was introduced
+            "average_price": doc["priced_value"] / doc["priced_volume"] if doc.get("priced_volume") else None,
+        })
+    return rollups
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import logs
+
+# Write-behind buffer for the transaction_history collection.
+# Routes call record() (no await, no Mongo round trip) and a background task
+# flushes the buffer with insert_many(ordered=False) once it is big enough or
+# old enough. Every event is appended to a local journal before it is
+# buffered and the journal is replayed on the next start, so a process crash
+# between record() and the flush loses nothing. The journal is fsync'ed off
+# the event loop every HISTORY_FSYNC_INTERVAL seconds (and each segment before
+# its insert), so a machine crash or power loss loses at most that interval.
+# Each process (uvicorn worker) journals to its own "<path>.<pid>" file, so
+# workers never rotate or flush each other's segments; journals left by
+# processes that are gone are adopted by the next writer that starts.
+# A segment is only deleted after both the insert and the on_flushed hook
+# succeeded; the hook gets a batch_id so it can skip batches it already applied.
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_JOURNAL_PATH = os.getenv("HISTORY_JOURNAL_PATH", "history.journal")
+HISTORY_FSYNC_INTERVAL = float(os.getenv("HISTORY_FSYNC_INTERVAL", "0.2"))
+
+DUPLICATE_KEY = 11000
+SEGMENT_SUFFIX = ".flushing"
+
+log = logs.get_logger("history")
+
+
+def _encode(event):
+    """Makes an event JSON-safe for the journal (ObjectId / datetime)."""
+    doc = dict(event)
+    doc["_id"] = str(doc["_id"])
+    if isinstance(doc.get("timestamp"), datetime):
+        doc["timestamp"] = doc["timestamp"].isoformat()
+    return doc
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, OverflowError, ValueError):
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def _fsync_fd(fd):
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_path(path):
+    _fsync_fd(os.open(path, os.O_RDONLY))
+
+
+def _decode(doc):
+    doc["_id"] = ObjectId(doc["_id"])
+    if isinstance(doc.get("timestamp"), str):
+        doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+    return doc
+
+
+class HistoryWriter:
+    def __init__(self, collection, batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, journal_path=HISTORY_JOURNAL_PATH,
+                 on_flushed=None, fsync_interval=HISTORY_FSYNC_INTERVAL):
+        self.collection = collection
+        # Optional coroutine called as on_flushed(events, batch_id) once a batch is in Mongo
+        self.on_flushed = on_flushed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.journal_base = journal_path
+
+        self._buffer = []
+        self._segment = 0
+        self._journal = None
+        self._unsynced = False  # journal writes not fsync'ed yet
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sync_task = None
+        self._flush_lock = asyncio.Lock()
+
+        # Metrics
+        self.flushed_total = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def journal_path(self):
+        """This process's journal"""
+        return f"{self.journal_base}.{os.getpid()}"
+
+    @journal_path.setter
+    def journal_path(self, path):
+        self.journal_base = path
+
+    # --- PUBLIC API ---
+    def record(self, event):
+        """Buffers one history event. Never blocks on Mongo."""
+        event = dict(event)
+        # A client-side _id makes journal replays idempotent (duplicates are skipped)
+        event.setdefault("_id", ObjectId())
+        self._journal_append(event)
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return event["_id"]
+
+    async def start(self):
+        """Replays any journal left by a crash, then starts the flush loop."""
+        await self._replay_journal()
+        self._task = asyncio.create_task(self._run())
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        """Drains the buffer; called from lifespan shutdown."""
+        for task in (self._task, self._sync_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._sync_task = None
+        await self.flush()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._buffer),
+            "flushed_total": self.flushed_total,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+        }
+
+    # --- FLUSHING ---
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep the loop alive; the events are still journaled
+                self.failed_flushes += 1
+                log.error("History flush loop error", extra={"error": str(e)})
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                log.error("History journal fsync failed", extra={"error": str(e)})
+
+    async def sync(self):
+        """fsyncs what record() has journaled so far, in a worker thread"""
+        if not self._unsynced or self._journal is None:
+            return
+        self._unsynced = False
+        # A duplicate descriptor stays valid if the journal is rotated meanwhile
+        await asyncio.to_thread(_fsync_fd, os.dup(self._journal.fileno()))
+
+    async def flush(self):
+        async with self._flush_lock:
+            # Retry segments whose earlier flush failed before taking new events
+            for segment in self._pending_segments():
+                if not await self._flush_segment(segment, self._read_segment(segment)):
+                    return
+
+            if not self._buffer:
+                return
+
+            # Swap the buffer and rotate the journal together (no await in between),
+            # so the rotated segment holds exactly this batch.
+            batch, self._buffer = self._buffer, []
+            segment = self._rotate_journal()
+            # The segment is the only durable copy until Mongo acknowledges the insert
+            await asyncio.to_thread(_fsync_path, segment)
+            await self._flush_segment(segment, batch)
+
+    async def _flush_segment(self, segment, batch):
+        started = time.perf_counter()
+        inserted = len(batch)
+        try:
+            if batch:
+                await self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys mean the batch was already written before a crash
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                self.failed_flushes += 1
+                log.error("History flush failed, keeping journal segment", extra={"error": str(e)})
+                return False
+            inserted -= len(errors)
+        except Exception as e:
+            self.failed_flushes += 1
+            log.error("History flush failed, keeping journal segment", extra={"error": str(e)})
+            return False
+
+        if self.on_flushed and batch:
+            # The first event's _id names the batch across retries and replays
+            try:
+                await self.on_flushed(batch, str(batch[0]["_id"]))
+            except Exception as e:
+                self.failed_flushes += 1
+                log.error("History on_flushed hook failed, keeping journal segment", extra={"error": str(e)})
+                return False
+
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self.flushed_total += inserted
+        try:
+            os.remove(segment)
+        except FileNotFoundError:
+            pass
+        return True
+
+    # --- JOURNAL ---
+    def _journal_append(self, event):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.write(json.dumps(_encode(event), default=str) + "\n")
+        self._journal.flush()  # in the OS after this; on disk after the next sync()
+        self._unsynced = True
+
+    def _rotate_journal(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        self._unsynced = False  # flush() fsyncs the segment
+        self._segment += 1
+        segment = f"{self.journal_path}.{int(time.time() * 1000)}.{self._segment}{SEGMENT_SUFFIX}"
+        os.replace(self.journal_path, segment)
+        return segment
+
+    def _pending_segments(self):
+        folder = os.path.dirname(self.journal_path) or "."
+        prefix = os.path.basename(self.journal_path) + "."
+        return sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.startswith(prefix) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _adopt_orphans(self):
+        """Claims journals and segments of processes that are gone (crashed or restarted workers)"""
+        folder = os.path.dirname(self.journal_base) or "."
+        base = os.path.basename(self.journal_base)
+        own = os.path.basename(self.journal_path)
+        for name in os.listdir(folder):
+            if name == base:
+                owner, rest = "legacy", ""  # written before journals were per process
+            elif name.startswith(base + "."):
+                owner, _, rest = name[len(base) + 1:].partition(".")
+                if not owner.isdigit() or name.startswith(own + ".") or name == own or _alive(int(owner)):
+                    continue
+                rest = f".{rest}" if rest else ""
+            else:
+                continue
+            if not rest.endswith(SEGMENT_SUFFIX):
+                # A live journal: turn it into one of our segments
+                rest = f".{int(time.time() * 1000)}.{owner}{SEGMENT_SUFFIX}"
+            try:
+                os.replace(os.path.join(folder, name), self.journal_path + rest)
+            except FileNotFoundError:
+                pass  # another worker adopted it first
+
+    def _read_segment(self, path):
+        events = []
+        if not os.path.exists(path):
+            return events
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(_decode(json.loads(line)))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+        return events
+
+    async def _replay_journal(self):
+        self._adopt_orphans()
+        if os.path.exists(self.journal_path):
+            # Anything recorded before start() is in this journal too
+            self._rotate_journal()
+            self._buffer = []
+        replayed = 0
+        for segment in self._pending_segments():
+            events = self._read_segment(segment)
+            if await self._flush_segment(segment, events):
+                replayed += len(events)
+        if replayed:
+            log.info("Replayed history events from journal", extra={"events": replayed})
@@ -0,0 +1,165 @@
+import os
+import json
+import asyncio
+import hashlib
+import contextvars
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+# Idempotency-Key support for routes that sign and broadcast transactions.
+# The first response for (route scope, key) is stored in a TTL'd collection and
+# replayed for retries; concurrent identical requests in this process await the
+# same in-flight future instead of each sending a transaction.
+# Every transaction a handler broadcasts is written to its key before the
+# receipt wait, so once anything went out a retry only reports those
+# transactions; a failure before the first broadcast frees the key.
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A "pending" claim older than this is assumed to belong to a crashed worker
+IDEMPOTENCY_PENDING_TIMEOUT = int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "300"))
+
+# Transient failures are not stored, so a retry gets a fresh attempt,
+# unless the failed attempt had already broadcast a transaction
+RETRYABLE_STATUSES = {"ERROR", "BLOCKCHAIN_DELAY"}
+
+# The key whose handler is running in the current task
+_current_doc = contextvars.ContextVar("idempotency_doc", default=None)
+
+
+def _default_cacheable(response):
+    return not (isinstance(response, dict) and response.get("status") in RETRYABLE_STATUSES)
+
+
+def _fingerprint(params):
+    raw = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, tx_status=None):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.tx_status = tx_status  # tx hash -> {"tx_hash", "state", ...}, blocking
+        self._inflight = {}  # doc id -> (fingerprint, future)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def run(self, key, scope, params, handler, cacheable=_default_cacheable):
+        """Runs handler() at most once per (scope, key) and returns its first response"""
+        if not key:
+            return await handler()
+
+        doc_id = f"{scope}:{key}"
+        fingerprint = _fingerprint(params)
+
+        # 1. Coalesce onto an identical request already running in this process
+        inflight = self._inflight.get(doc_id)
+        if inflight:
+            self._check_fingerprint(inflight[0], fingerprint)
+            return await asyncio.shield(inflight[1])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[doc_id] = (fingerprint, future)
+        try:
+            response = await self._run_once(doc_id, fingerprint, handler, cacheable)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            self._inflight.pop(doc_id, None)
+
+    async def _run_once(self, doc_id, fingerprint, handler, cacheable):
+        # 2. Replay a stored response, or claim the key for this request
+        if not await self._claim(doc_id, fingerprint):
+            doc = await self.collection.find_one({"_id": doc_id})
+            stale = doc and doc["created_at"] < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT)
+            if doc and doc.get("state") == "completed":
+                self._check_fingerprint(doc["fingerprint"], fingerprint)
+                return doc["response"]
+            if doc and doc.get("tx_hashes") and (doc.get("state") == "broadcast" or stale):
+                # Failed or crashed after broadcasting: never send again, report instead
+                self._check_fingerprint(doc["fingerprint"], fingerprint)
+                return await self._broadcast_report(doc)
+            if stale:
+                await self.collection.delete_one({"_id": doc_id, "state": "pending", "created_at": doc["created_at"],
+                                                  "tx_hashes": {"$exists": False}})
+                if await self._claim(doc_id, fingerprint):
+                    return await self._execute(doc_id, handler, cacheable)
+            if doc:
+                self._check_fingerprint(doc["fingerprint"], fingerprint)
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is already in progress")
+
+        # 3. First time we see this key: do the work
+        return await self._execute(doc_id, handler, cacheable)
+
+    async def _claim(self, doc_id, fingerprint):
+        try:
+            await self.collection.insert_one({
+                "_id": doc_id,
+                "fingerprint": fingerprint,
+                "state": "pending",
+                "created_at": datetime.utcnow()
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _execute(self, doc_id, handler, cacheable):
+        token = _current_doc.set(doc_id)
+        try:
+            response = await handler()
+        except BaseException:
+            await self._release(doc_id)
+            raise
+        finally:
+            _current_doc.reset(token)
+
+        if cacheable(response):
+            await self.collection.update_one(
+                {"_id": doc_id},
+                {"$set": {"state": "completed", "response": response, "created_at": datetime.utcnow()}}
+            )
+        else:
+            await self._release(doc_id, response)
+        return response
+
+    async def _release(self, doc_id, response=None):
+        """Frees the key for a retry, unless the handler got as far as broadcasting"""
+        kept = await self.collection.update_one(
+            {"_id": doc_id, "tx_hashes.0": {"$exists": True}},
+            {"$set": {"state": "broadcast", "response": response, "created_at": datetime.utcnow()}}
+        )
+        if not kept.matched_count:
+            await self.collection.delete_one({"_id": doc_id})
+
+    async def record_broadcast(self, tx_hash):
+        """Called right after send_raw_transaction; a no-op outside an idempotent request"""
+        doc_id = _current_doc.get()
+        if doc_id:
+            await self.collection.update_one({"_id": doc_id}, {"$push": {"tx_hashes": tx_hash}})
+
+    async def _broadcast_report(self, doc):
+        if self.tx_status:
+            transactions = await asyncio.gather(*(asyncio.to_thread(self.tx_status, tx_hash)
+                                                  for tx_hash in doc["tx_hashes"]))
+        else:
+            transactions = [{"tx_hash": tx_hash} for tx_hash in doc["tx_hashes"]]
+        return {
+            "status": "ALREADY_BROADCAST",
+            "message": "This request already broadcast its transactions; they are not sent again",
+            "transactions": list(transactions),
+            "first_response": doc.get("response")
+        }
+
+    def _check_fingerprint(self, stored, fingerprint):
+        if stored != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with different request parameters"
+            )
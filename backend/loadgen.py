@@ -0,0 +1,414 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+import aiohttp
+import requests
+from dotenv import load_dotenv
+from eth_account import Account
+from motor.motor_asyncio import AsyncIOMotorClient
+from PIL import Image, ImageDraw, ImageFont
+from web3 import Web3
+
+from rpc_provider import make_web3
+
+# End-to-end load generator: N synthetic companies go through
+#   phase-1 minting -> listing -> mark-paid + release -> phase-2 settlement
+# concurrently, against a local node (RPC_URL, e.g. `npx hardhat node`) and a
+# local MongoDB (MONGO_DETAILS), with CONTRACT_ADDRESS / PRIVATE_KEY from .env.
+#
+#   python loadgen.py --companies 50 --concurrency 16
+#
+# Company keys are generated once into loadgen_keys.json and funded with ETH
+# from PRIVATE_KEY. By default the API is started as a subprocess with those
+# keys in its environment. To drive a server you run yourself:
+#   python loadgen.py --provision-only        # writes loadgen.env
+#   (start uvicorn with loadgen.env loaded)
+#   python loadgen.py --base-url http://localhost:8000
+#
+# Reports throughput, latency percentiles and errors per step, nonce
+# collisions, and drift between what the run did, the chain and MongoDB.
+
+load_dotenv()
+
+KEYS_FILE = "loadgen_keys.json"
+ENV_FILE = "loadgen.env"
+PDF_DIR = "loadgen_pdfs"
+SERVER_LOG = "loadgen_server.log"
+FUNDING_ETH = 1
+
+NONCE_ERRORS = re.compile(
+    r"nonce too low|nonce has already been used|already known|replacement transaction underpriced|invalid nonce",
+    re.IGNORECASE
+)
+
+
+# 1. PROVISIONING
+def company_name(i):
+    return f"LOAD_{i:04d}"
+
+
+def load_or_create_keys(count):
+    keys = {}
+    if os.path.exists(KEYS_FILE):
+        with open(KEYS_FILE) as f:
+            keys = json.load(f)
+    for i in range(count):
+        keys.setdefault(company_name(i), Account.create().key.to_0x_hex())
+    with open(KEYS_FILE, "w") as f:
+        json.dump(keys, f, indent=2)
+    with open(ENV_FILE, "w") as f:
+        for name, key in keys.items():
+            f.write(f"{name}_PRIVATE_KEY={key}\n")
+    return {company_name(i): keys[company_name(i)] for i in range(count)}
+
+
+def fund_wallets(w3, wallets):
+    """Tops every wallet up to FUNDING_ETH from PRIVATE_KEY (before the load starts)"""
+    funder = Account.from_key(os.getenv("PRIVATE_KEY"))
+    target = Web3.to_wei(FUNDING_ETH, "ether")
+    nonce = w3.eth.get_transaction_count(funder.address, "pending")
+    pending = []
+    for wallet in wallets:
+        missing = target - w3.eth.get_balance(wallet)
+        if missing <= 0:
+            continue
+        signed = funder.sign_transaction({
+            "to": wallet, "value": missing, "gas": 21000, "nonce": nonce,
+            "gasPrice": w3.eth.gas_price, "chainId": w3.eth.chain_id
+        })
+        pending.append(w3.eth.send_raw_transaction(signed.raw_transaction))
+        nonce += 1
+    for tx_hash in pending:
+        w3.eth.wait_for_transaction_receipt(tx_hash)
+    print(f"⛽ Funded {len(pending)} wallets with up to {FUNDING_ETH} ETH")
+
+
+def render_pdf(path, lines):
+    """One letter-size page at 200 DPI with large, OCR-friendly text"""
+    page = Image.new("L", (1700, 2200), 255)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=56)
+    for row, line in enumerate(lines):
+        draw.text((150, 200 + row * 110), line, fill=0, font=font)
+    page.save(path, "PDF", resolution=200)
+
+
+def generate_documents(plan):
+    os.makedirs(PDF_DIR, exist_ok=True)
+    for name, company in plan.items():
+        company["registration_pdf"] = os.path.join(PDF_DIR, f"{name}_registration.pdf")
+        company["audit_pdf"] = os.path.join(PDF_DIR, f"{name}_audit.pdf")
+        render_pdf(company["registration_pdf"], [
+            "Carbon Registration Certificate",
+            f"Company: {name}",
+            f"Verified allowance: {company['allowance']} tons",
+        ])
+        render_pdf(company["audit_pdf"], [
+            "Annual Emissions Audit",
+            f"Company: {name}",
+            f"Verified total: {company['consumption']} tCO2e",
+        ])
+
+
+# 2. RESULTS
+class Recorder:
+    def __init__(self):
+        self.steps = {}  # step -> {"latencies": [...], "errors": {...}, "started", "finished"}
+        self.nonce_collisions = 0
+
+    def record(self, step, seconds, ok, error=None):
+        entry = self.steps.setdefault(step, {"latencies": [], "ok": 0, "errors": {},
+                                             "started": time.perf_counter() - seconds, "finished": 0})
+        entry["latencies"].append(seconds)
+        entry["finished"] = time.perf_counter()
+        if ok:
+            entry["ok"] += 1
+            return
+        error = str(error)[:120]
+        entry["errors"][error] = entry["errors"].get(error, 0) + 1
+        if NONCE_ERRORS.search(error):
+            self.nonce_collisions += 1
+
+    def summary(self):
+        report = {}
+        for step, entry in self.steps.items():
+            latencies = sorted(entry["latencies"])
+            elapsed = max(entry["finished"] - entry["started"], 1e-9)
+
+            def pct(p):
+                return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1)
+
+            report[step] = {
+                "requests": len(latencies),
+                "ok": entry["ok"],
+                "error_rate": round(1 - entry["ok"] / len(latencies), 4),
+                "throughput_per_s": round(len(latencies) / elapsed, 2),
+                "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99), "max_ms": pct(100),
+                "errors": entry["errors"],
+            }
+        return report
+
+
+# 3. LOAD
+async def timed(recorder, step, session, method, path, ok_status, **kwargs):
+    started = time.perf_counter()
+    try:
+        async with session.request(method, path, **kwargs) as response:
+            body = await response.json(content_type=None)
+    except Exception as e:
+        recorder.record(step, time.perf_counter() - started, False, e)
+        return None
+    ok = response.status == 200 and body.get("status") in ok_status
+    error = None if ok else body.get("message") or body.get("detail") or body.get("details") or body.get("status")
+    recorder.record(step, time.perf_counter() - started, ok, f"{response.status} {error}" if error else None)
+    return body if ok else None
+
+
+def upload(path):
+    # Read up front: a file object in the form stays open until it is garbage collected
+    with open(path, "rb") as f:
+        content = f.read()
+    form = aiohttp.FormData()
+    form.add_field("file", content, filename=os.path.basename(path), content_type="application/pdf")
+    return form
+
+
+async def run_step(label, items, concurrency, worker):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(item):
+        async with semaphore:
+            await worker(item)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(item) for item in items))
+    print(f"✅ {label}: {len(items)} in {time.perf_counter() - started:.1f}s")
+
+
+async def drive(args, plan, contract):
+    recorder = Recorder()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    async with aiohttp.ClientSession(args.base_url, timeout=timeout, connector=connector) as session:
+
+        async def mint(name):
+            company = plan[name]
+            body = await timed(recorder, "phase1-minting", session, "POST", f"/phase1-minting/{name}", {"SUCCESS"},
+                               params={"wallet_address": company["wallet"]}, data=upload(company["registration_pdf"]))
+            # A failed mint still answers SUCCESS, with no transaction
+            if body and body.get("blockchain_tx"):
+                company["minted"] = body["tons_allocated"]
+            elif body:
+                recorder.record("phase1-mint-tx", 0, False, "mint returned no transaction")
+
+        async def list_tokens(name):
+            company = plan[name]
+            if not company["minted"]:
+                return
+            qr_url = f"upi://pay?pa={name.lower()}@loadgen&tn={random.getrandbits(32)}"
+            body = await timed(recorder, "list-with-price", session, "POST", "/marketplace/list-with-price", {"LISTED"},
+                               params={"company_name": name, "amount": company["list_amount"],
+                                       "price": company["price"], "qr_url": qr_url})
+            if body:
+                company["listed"] = company["list_amount"]
+                company["listing"] = {"reported_id": body["listing_id"], "qr_url": qr_url}
+
+        async def trade(pair):
+            seller, buyer = plan[pair[0]], plan[pair[1]]
+            listing = seller.get("listing")
+            if not listing:
+                return
+            body = await timed(recorder, "mark-paid", session, "POST", f"/marketplace/mark-paid/{listing['id']}", {"MARKED_PAID"},
+                               params={"buyer_company": pair[1]})
+            if not body:
+                return
+            body = await timed(recorder, "release", session, "POST", f"/marketplace/release/{listing['id']}", {"RELEASED"},
+                               params={"buyer_wallet": buyer["wallet"]})
+            if body:
+                buyer["bought"] += seller["listed"]
+
+        async def settle(name):
+            if plan[name]["minted"]:
+                await timed(recorder, "phase2-settlement", session, "POST", f"/phase2-settlement/{name}",
+                            {"SETTLEMENT_SUCCESS", "DEFICIT"}, data=upload(plan[name]["audit_pdf"]))
+
+        names = list(plan)
+        started = time.perf_counter()
+        await run_step("Phase 1 minting", names, args.concurrency, mint)
+        await run_step("Listings", names, args.concurrency, list_tokens)
+        listing_mismatches = await asyncio.to_thread(resolve_listings, contract, plan)
+        pairs = [(names[i], names[(i + 1) % len(names)]) for i in range(len(names))] if len(names) > 1 else []
+        await run_step("Trades (mark-paid + release)", pairs, args.concurrency, trade)
+        await run_step("Phase 2 settlement", names, args.concurrency, settle)
+        total_seconds = time.perf_counter() - started
+
+    return recorder, listing_mismatches, total_seconds
+
+
+def resolve_listings(contract, plan):
+    """Checks the listing_id list-with-price reported (matched by the server
+    in the receipt's block) against the chain, finding each seller's listing
+    by its unique QR URL; returns how many were reported wrong"""
+    by_qr = {}
+    for listing_id in range(contract.functions.nextListingId().call()):
+        listing = contract.functions.marketListings(listing_id).call()
+        if listing[6]:
+            by_qr[listing[4]] = listing_id
+    mismatches = 0
+    for company in plan.values():
+        listing = company.get("listing")
+        if not listing:
+            continue
+        listing["id"] = by_qr.get(listing["qr_url"], listing["reported_id"])
+        mismatches += listing["id"] != listing["reported_id"]
+    return mismatches
+
+
+# 4. DRIFT
+async def check_drift(plan, contract):
+    """What the run did vs. what the chain holds vs. what MongoDB recorded"""
+    client = AsyncIOMotorClient(os.getenv("MONGO_DETAILS"))
+    companies_col = client.carbon_cred_db.get_collection("companies")
+    docs = {doc["name"]: doc async for doc in companies_col.find({"name": {"$in": list(plan)}})}
+    client.close()
+
+    drift = {"chain": [], "db": []}
+    for name, company in plan.items():
+        balance = contract.functions.balanceOf(Web3.to_checksum_address(company["wallet"])).call()
+        expected = company["minted"] - company["listed"] + company["bought"]
+        doc = docs.get(name, {})
+        if doc.get("status") == "audited":
+            expected -= doc.get("required_burn", 0)
+        if balance != expected:
+            drift["chain"].append({"company": name, "expected": expected, "on_chain": balance})
+
+        # initial_allowance = minted + every release bought into it
+        expected_allowance = company["minted"] + company["bought"]
+        if company["minted"] and doc.get("initial_allowance") != expected_allowance:
+            drift["db"].append({"company": name, "expected": expected_allowance,
+                                "initial_allowance": doc.get("initial_allowance")})
+    return drift
+
+
+# 5. SERVER
+def start_server(args, keys):
+    env = dict(os.environ)
+    env.update({f"{name}_PRIVATE_KEY": key for name, key in keys.items()})
+    log = open(SERVER_LOG, "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--workers", str(args.workers)],
+        env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API server exited during startup; see {SERVER_LOG}")
+        try:
+            requests.get(f"{args.base_url}/rpc/status", timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"API server did not come up; see {SERVER_LOG}")
+
+
+def count_server_nonce_errors():
+    # Minting swallows its errors into the server log; count them there too
+    if not os.path.exists(SERVER_LOG):
+        return 0
+    with open(SERVER_LOG, errors="replace") as f:
+        return sum(1 for line in f if NONCE_ERRORS.search(line))
+
+
+def build_plan(keys, seed):
+    rng = random.Random(seed)
+    plan = {}
+    for name, key in keys.items():
+        allowance = rng.randrange(200, 2000)
+        plan[name] = {
+            "wallet": Account.from_key(key).address,
+            "allowance": allowance,
+            # Around a third of companies end up needing to buy
+            "consumption": int(allowance * rng.uniform(0.5, 1.3)),
+            "list_amount": rng.randrange(10, 100),
+            "price": rng.randrange(5, 60),
+            "minted": 0, "listed": 0, "bought": 0,
+        }
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive N synthetic companies through the full flow")
+    parser.add_argument("--companies", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-url", help="Use an already running API instead of starting one")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--provision-only", action="store_true", help="Generate keys, PDFs and funding, then exit")
+    parser.add_argument("--report", default="loadgen_report.json")
+    args = parser.parse_args()
+
+    w3 = make_web3()
+    with open("abi.json") as f:
+        artifact = json.load(f)
+    contract_abi = artifact["abi"] if isinstance(artifact, dict) and "abi" in artifact else artifact
+    contract = w3.eth.contract(address=os.getenv("CONTRACT_ADDRESS"), abi=contract_abi)
+
+    print(f"🏭 Provisioning {args.companies} synthetic companies...")
+    keys = load_or_create_keys(args.companies)
+    plan = build_plan(keys, args.seed)
+    generate_documents(plan)
+    fund_wallets(w3, [company["wallet"] for company in plan.values()])
+    if args.provision_only:
+        print(f"📝 Keys written to {ENV_FILE}; start the API with it loaded, then rerun with --base-url")
+        return
+
+    server = None
+    if not args.base_url:
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        print(f"🚀 Starting API on {args.base_url} (log: {SERVER_LOG})...")
+        server = start_server(args, keys)
+    try:
+        recorder, listing_mismatches, total_seconds = asyncio.run(drive(args, plan, contract))
+        print("🔍 Checking chain and DB drift...")
+        drift = asyncio.run(check_drift(plan, contract))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "companies": args.companies,
+        "concurrency": args.concurrency,
+        "total_seconds": round(total_seconds, 2),
+        "steps": recorder.summary(),
+        "nonce_collisions": recorder.nonce_collisions + (count_server_nonce_errors() if server else 0),
+        "listing_id_mismatches": listing_mismatches,
+        "drift": drift,
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n📊 {args.companies} companies, concurrency {args.concurrency}, {total_seconds:.1f}s total")
+    for step, stats in report["steps"].items():
+        print(f"   {step:<20} {stats['requests']:>5} req  {stats['throughput_per_s']:>7.2f}/s  "
+              f"p50 {stats['p50_ms']:>8.1f}ms  p99 {stats['p99_ms']:>8.1f}ms  errors {stats['error_rate']:.1%}")
+        for error, count in stats["errors"].items():
+            print(f"      ❌ {count}x {error}")
+    print(f"   Nonce collisions: {report['nonce_collisions']}")
+    print(f"   Listing IDs misreported: {listing_mismatches}")
+    print(f"   Chain drift: {len(drift['chain'])} companies | DB drift: {len(drift['db'])} companies")
+    print(f"📝 Full report: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
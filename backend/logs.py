@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured, non-blocking logging.
+#   - Callers only put records on an in-memory queue (QueueHandler); a
+#     QueueListener thread formats them as one JSON object per line and writes
+#     stdout, so a slow terminal or log shipper never stalls the event loop.
+#     When the queue is full, records are dropped and counted, not waited on.
+#   - request_id (RequestContextMiddleware), company (bind()) and stage
+#     (stage, with duration_ms since the stage began) come from contextvars,
+#     so they follow a request into asyncio.to_thread.
+#   - INFO/DEBUG records can be sampled per category (logger name) with
+#     LOG_SAMPLE_RATES="access=0.1,ocr=0.5", and each INFO/DEBUG message is
+#     rate limited to LOG_RATE_LIMIT per LOG_RATE_WINDOW seconds; the next
+#     record let through carries how many were suppressed. WARNING records
+#     are never sampled, and only identical repeats (same message and error)
+#     are rate limited; ERROR and above always go through.
+#
+#   log = logs.get_logger("marketplace")
+#   log.warning("Marketplace list error", extra={"company": name, "error": str(e)})
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "access=0.1")
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+# Warning keys include the error text, so expired windows are pruned past this many
+LOG_RATE_MAX_KEYS = 10000
+
+ROOT_LOGGER = "carbon"
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+company_var = contextvars.ContextVar("company", default=None)
+stage_var = contextvars.ContextVar("stage", default=None)  # (name, perf_counter at start)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def get_logger(category):
+    """Loggers live under "carbon."; the category is what sampling is keyed on"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+
+def _parse_rates(spec):
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def bind(company):
+    """Tags the rest of the current request (task) with the company"""
+    company_var.set(company)
+
+
+@contextmanager
+def stage(name):
+    """Records inside get stage=name and duration_ms since the stage began"""
+    token = stage_var.set((name, time.perf_counter()))
+    try:
+        yield
+    finally:
+        stage_var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Runs in the caller's thread, where the contextvars are visible"""
+
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "company", None) is None:
+            record.company = company_var.get()
+        current = stage_var.get()
+        if current and getattr(record, "stage", None) is None:
+            record.stage = current[0]
+            if getattr(record, "duration_ms", None) is None:
+                record.duration_ms = round((time.perf_counter() - current[1]) * 1000, 1)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Per-category sampling of INFO/DEBUG, and a per-message rate limit for
+    INFO/DEBUG and for identical WARNING repeats"""
+
+    def __init__(self, rates=None, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.rates = _parse_rates(LOG_SAMPLE_RATES) if rates is None else rates
+        self.limit = limit
+        self.window = window
+        self._windows = {}  # (logger, msg template[, error]) -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self.warnings_rate_limited = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True  # failures are always logged
+        if record.levelno >= logging.WARNING:
+            # One template ("Marketplace list error") covers many different
+            # errors; only a repeat of the same one is throttled
+            return self._within_limit(record, (record.name, record.msg, getattr(record, "error", None)))
+
+        category = record.name.split(".", 1)[-1].split(".")[0]
+        rate = self.rates.get(category, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                self.sampled_out += 1
+                return False
+            record.sample_rate = rate
+        return self._within_limit(record, (record.name, record.msg))
+
+    def _within_limit(self, record, key):
+        """At most `limit` records per key per window; the first one of the
+        next window carries the suppressed count"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None and len(self._windows) >= LOG_RATE_MAX_KEYS:
+                self._windows = {k: w for k, w in self._windows.items() if now - w[0] < self.window}
+            if window is None or now - window[0] >= self.window:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.limit:
+                window[2] += 1
+                self.rate_limited += 1
+                if record.levelno >= logging.WARNING:
+                    self.warnings_rate_limited += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread"""
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "category": record.name.split(".", 1)[-1],
+            "event": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                event[key] = value
+        if record.exc_text:
+            event["exc"] = record.exc_text
+        return json.dumps(event, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: a full queue drops the record"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format args now (they may change before the listener gets to them),
+        # but leave JSON rendering to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_pipeline = {}
+
+
+def configure(level=LOG_LEVEL, stream=None):
+    """Installs the queue pipeline on the "carbon" logger once per process"""
+    if _pipeline:
+        return _pipeline["handler"]
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter())
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # drains what is still queued
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.addHandler(handler)
+    root.propagate = False
+    _pipeline.update(handler=handler, listener=listener)
+    return handler
+
+
+def stats():
+    handler = _pipeline.get("handler")
+    if handler is None:
+        return {"configured": False}
+    sampler = next(f for f in handler.filters if isinstance(f, SamplingFilter))
+    return {
+        "configured": True,
+        "queue_depth": handler.queue.qsize(),
+        "queue_size": handler.queue.maxsize,
+        "dropped": handler.dropped,
+        "sampled_out": sampler.sampled_out,
+        "rate_limited": sampler.rate_limited,
+        "warnings_rate_limited": sampler.warnings_rate_limited,
+    }
+
+
+class RequestContextMiddleware:
+    """ASGI middleware: request_id from X-Request-ID (or a new one), echoed back,
+    plus one "access" record per request"""
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get("route")
+            self.log.info("Request", extra={
+                "method": scope["method"], "path": scope["path"],
+                "route": getattr(route, "path", "unmatched"), "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+            request_id_var.reset(token)
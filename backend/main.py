@@ -1,26 +1,63 @@
 import os
 import json
 import shutil
+import asyncio
+from dataclasses import asdict
 from datetime import datetime
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from web3 import Web3
+from web3.exceptions import TransactionNotFound
+from hexbytes import HexBytes
 from pydantic import BaseModel
 
+import history
+from history_writer import HistoryWriter
+from idempotency import IdempotencyStore
+from fees import FeeOracle, GasEstimator
+from read_cache import ContractReadCache
+from rpc_provider import MultiEndpointProvider, RpcMetricsMiddleware, rpc_urls
+from admission import OcrAdmission, estimate_ocr_bytes, OCR_DPI
+from ocr_queue import OcrTaskQueue
+from ocr_result import ExtractionResult
+import metrics
+import logs
+import profiler
+import responses
+from order_book import OrderBook
+
 # 1. SETUP & CONFIGURATION
 load_dotenv()
 
+# JSON logs written by a background thread (see logs.py)
+logs.configure()
+log = logs.get_logger("api")
+market_log = logs.get_logger("marketplace")
+
 # 2. BLOCKCHAIN & ENV INITIALIZATION
-RPC_URL = os.getenv("RPC_URL", "http://127.0.0.1:8545")
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
+# RPC_URLS="primary,replica,..." or a single RPC_URL (see rpc_provider.py)
+w3 = Web3(MultiEndpointProvider(rpc_urls()))
+w3.middleware_onion.add(RpcMetricsMiddleware, "rpc_metrics")
 
 # Fetches from .env names, not raw values
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
+# Workers that never run OCR can skip importing OpenCV/tesseract at startup
+OCR_PRELOAD = os.getenv("OCR_PRELOAD", "1") == "1"
+# "local" runs OCR in this process; "queue" hands it to ocr_worker.py processes
+OCR_BACKEND = os.getenv("OCR_BACKEND", "local")
+# Without CHAIN_ID the chain check can only compare the node with itself; "1" fails /ready instead
+REQUIRE_CHAIN_ID = os.getenv("REQUIRE_CHAIN_ID", "0") == "1"
+# /ready re-runs failed startup checks at most this often
+READY_RECHECK_INTERVAL = float(os.getenv("READY_RECHECK_INTERVAL", "5"))
+
+contract = None
 
 try:
     with open("abi.json", "r") as f:
@@ -28,29 +65,211 @@ try:
         # Handles both raw ABI arrays and Hardhat artifact formats
         contract_abi = artifact["abi"] if isinstance(artifact, dict) and "abi" in artifact else artifact
     contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
+    RpcMetricsMiddleware.register_abi(contract_abi)
 except Exception as e:
-    print(f"⚠️ Warning: Could not load ABI or Contract: {e}")
+    log.warning("Could not load ABI or contract", extra={"error": str(e)})
+
+# Cached fees, gas limits and chain ID (see fees.py)
+fee_oracle = FeeOracle(w3)
+gas_estimator = GasEstimator()
+
+# View-call results cached per block (see read_cache.py)
+read_cache = ContractReadCache(w3)
 
 # 3. MONGODB INITIALIZATION
 MONGO_DETAILS = os.getenv("MONGO_DETAILS")
-client = AsyncIOMotorClient(MONGO_DETAILS)
+client = AsyncIOMotorClient(MONGO_DETAILS, event_listeners=[metrics.MongoCommandMetrics()])
 db = client.carbon_cred_db
 companies_col = db.get_collection("companies")
 history_col = db.get_collection("transaction_history")
+rollups_col = db.get_collection("history_daily_rollups")
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print("Connecting to MongoDB Atlas...")
+# History events are buffered and written in batches (see history_writer.py);
+# each flushed batch also updates the daily rollups (see history.py)
+history_writer = HistoryWriter(
+    history_col,
+    on_flushed=lambda events, batch_id: history.apply_rollups(rollups_col, events, batch_id)
+)
+
+# OCR tasks claimed by ocr_worker.py when OCR_BACKEND=queue (see ocr_queue.py)
+ocr_queue = OcrTaskQueue(db.get_collection("ocr_tasks"))
+
+def wallet_query(*wallets):
+    """Matches wallets stored either lowercased or checksummed, without a regex scan"""
+    variants = set()
+    for wallet in wallets:
+        variants.update({wallet.lower(), Web3.to_checksum_address(wallet)})
+    return {"wallet_address": {"$in": list(variants)}}
+
+# First responses of on-chain write routes, replayed for Idempotency-Key retries
+idempotency = IdempotencyStore(db.get_collection("idempotency_keys"),
+                               tx_status=lambda tx_hash: transaction_status(tx_hash))
+
+# Open (active, unpaid) listings sorted by price (see order_book.py)
+# Each process keeps its own book; sync_order_book() runs on every new block
+# so listings opened, paid or released by other workers (or directly
+# on-chain) show up here too.
+order_book = OrderBook()
+# Listing IDs below this have been read into the order book
+order_book_next_id = 0
+
+async def read_listings(ids):
+    """marketListings(i) for every id, in parallel threads so the RPC provider batches them"""
+    return await asyncio.gather(*(
+        asyncio.to_thread(read_cache.call, contract.functions.marketListings(i)) for i in ids
+    ))
+
+async def seller_names(listings):
+    names = {}
+    async for doc in companies_col.find(wallet_query(*(listing[1] for listing in listings))):
+        names[doc["wallet_address"].lower()] = doc["name"]
+    return names
+
+async def hydrate_order_book():
+    """Rebuilds the order book from marketListings on-chain"""
+    global order_book_next_id
+    next_id = await asyncio.to_thread(read_cache.call, contract.functions.nextListingId())
+    open_listings = [
+        listing for listing in await read_listings(range(next_id))
+        if listing[6] and not listing[5]  # active and not yet paid
+    ]
+    names = await seller_names(open_listings)
+
+    order_book.clear()
+    for listing in open_listings:
+        order_book.add(
+            listing[0], listing[1], listing[2], listing[3], listing[4],
+            seller_company=names.get(listing[1].lower(), "Unknown")
+        )
+    order_book_next_id = next_id
+
+async def sync_order_book(block):
+    """
+    Brings the order book up to `block`: re-reads every listing in it (markAsPaid
+    emits no event, so a payment only shows in marketListings) and the ones
+    created since the last sync. One RPC per open listing, batched.
+    """
+    global order_book_next_id
+    next_id = await asyncio.to_thread(read_cache.call, contract.functions.nextListingId())
+    ids = order_book.ids() + list(range(order_book_next_id, next_id))
+    listings = await read_listings(ids)
+    if read_cache.block != block:
+        return  # a newer block arrived meanwhile; its sync takes over
+
+    new_listings = [listing for listing in listings if listing[0] not in order_book]
+    names = await seller_names(new_listings) if new_listings else {}
+    for listing in listings:
+        if not listing[6] or listing[5]:
+            order_book.remove(listing[0])
+        elif listing[0] not in order_book:
+            order_book.add(
+                listing[0], listing[1], listing[2], listing[3], listing[4],
+                seller_company=names.get(listing[1].lower(), "Unknown")
+            )
+    order_book_next_id = max(order_book_next_id, next_id)
+
+# Startup checks by component, reported by /ready; failed ones are re-run from there
+readiness = {}
+startup_checks = {}  # component -> check
+checked_at = {}      # component -> loop time of the last run
+
+async def startup_check(component, check):
+    """Runs one startup step; failures are recorded for /ready instead of aborting startup"""
+    startup_checks[component] = check
+    checked_at[component] = asyncio.get_running_loop().time()
     try:
-        await client.admin.command('ping')
-        print("✅ SUCCESS: Connected to MongoDB Atlas!")
+        readiness[component] = {"ok": True, "detail": await check()}
     except Exception as e:
-        print(f"❌ ERROR: Could not connect to MongoDB: {e}")
+        readiness[component] = {"ok": False, "detail": str(e)}
+        log.warning("Startup check failed", extra={"component": component, "error": str(e)})
+
+async def create_indexes():
+    await history.ensure_indexes(history_col, rollups_col)
+    backfilled = await history.backfill_companies(history_col)
+    await idempotency.ensure_indexes()
+    await companies_col.create_index("name")
+    await companies_col.create_index("wallet_address")
+    await ocr_queue.ensure_indexes()
+    return {"indexes": "history, rollups, idempotency, companies, ocr_tasks",
+            "history_companies_backfilled": backfilled}
+
+def validate_contract():
+    """
+    The configured address must hold code and answer calls from our ABI.
+    The chain ID is only checked against CHAIN_ID when that is set; otherwise
+    it comes from the node itself (reported as chain_id_pinned: false).
+    """
+    if contract is None:
+        raise RuntimeError("Contract not loaded; check CONTRACT_ADDRESS and abi.json")
+    if REQUIRE_CHAIN_ID and not fee_oracle.chain_id_pinned:
+        raise RuntimeError("CHAIN_ID is not set (REQUIRE_CHAIN_ID=1)")
+    chain_id = w3.eth.chain_id
+    if fee_oracle.chain_id != chain_id:
+        raise RuntimeError(f"CHAIN_ID is {fee_oracle.chain_id} but the node serves chain {chain_id}")
+    if not w3.eth.get_code(contract.address):
+        raise RuntimeError(f"No contract code at {contract.address} on chain {chain_id}")
+    return {"chain_id": chain_id, "chain_id_pinned": fee_oracle.chain_id_pinned, "address": contract.address,
+            "next_listing_id": contract.functions.nextListingId().call()}
+
+def warm_up_ocr():
+    import ocr_engine
+    return ocr_engine.warm_up()
+
+async def start_fee_oracle():
+    await fee_oracle.start()
+    return {"chain_id": fee_oracle.chain_id}
+
+async def start_block_watcher():
+    await read_cache.start()
+    return {"block": read_cache.block}
+
+async def load_order_book():
+    await hydrate_order_book()
+    return {"open_listings": len(order_book)}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log.info("Connecting to MongoDB Atlas")
+    await startup_check("mongo", lambda: client.admin.command('ping'))
+    if readiness["mongo"]["ok"]:
+        log.info("Connected to MongoDB Atlas")
+    await startup_check("indexes", create_indexes)
+    await history_writer.start()
+    # Chain and OCR warm-up overlap; both mostly wait on I/O or native code
+    checks = [
+        startup_check("contract", lambda: asyncio.to_thread(validate_contract)),
+        startup_check("fee_oracle", start_fee_oracle),
+        startup_check("block_watcher", start_block_watcher),
+    ]
+    if OCR_PRELOAD and OCR_BACKEND == "local":
+        checks.append(startup_check("ocr", lambda: asyncio.to_thread(warm_up_ocr)))
+    await asyncio.gather(*checks)
+    if readiness["fee_oracle"]["ok"]:
+        log.info("Fee oracle ready", extra={"chain_id": fee_oracle.chain_id})
+    if "ocr" in readiness and readiness["ocr"]["ok"]:
+        log.info("OCR warmed up", extra={"detail": readiness["ocr"]["detail"]})
+    await startup_check("order_book", load_order_book)
+    if readiness["order_book"]["ok"]:
+        log.info("Order book loaded", extra={"open_listings": len(order_book)})
+    read_cache.on_new_block(sync_order_book)
     yield
+    await fee_oracle.stop()
+    await read_cache.stop()
+    await history_writer.stop()
     client.close()
 
 app = FastAPI(lifespan=lifespan)
 
+# brotli/gzip for large bodies; innermost, so latency metrics include it (see responses.py)
+app.add_middleware(responses.CompressionMiddleware)
+
+# Opt-in request profiling: X-Profile + X-Admin-Token, or PROFILE_SAMPLE_RATE (see profiler.py)
+profile_store = profiler.ProfileStore()
+app.add_middleware(profiler.ProfilingMiddleware, store=profile_store)
+
+# Per-route latency histograms (see metrics.py)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
 # 4. CORS MIDDLEWARE
 app.add_middleware(
     CORSMiddleware,
@@ -60,6 +279,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost: request IDs cover every other middleware's logs (see logs.py)
+app.add_middleware(logs.RequestContextMiddleware)
+
 os.makedirs("uploads", exist_ok=True)
 
 # 5. REQUEST SCHEMAS
@@ -71,44 +293,203 @@ class BuyRequest(BaseModel):
     company_name: str
     amount: int
 
+# Response shapes of the polled list endpoints. Routes return ORJSONResponse
+# directly, so these document the API without validating every row.
+class LeaderboardRow(BaseModel):
+    grade: str
+    company: str
+    net_surplus: int
+    status: str
+    last_verified_consumption: int
+    initial_allowance: int
+    wallet_address: str
+    compliance_result: str
+    settlement_tx: str
+
+class LeaderboardResponse(BaseModel):
+    leaderboard: List[LeaderboardRow]
+
+class ListingRow(BaseModel):
+    listing_id: int
+    seller_company: str
+    seller_wallet: str
+    amount: int
+    price_per_token: int
+    qr_url: str
+    is_paid: bool
+    active: bool
+
+class ListingsResponse(BaseModel):
+    status: str
+    listings: List[ListingRow] = []
+    message: Optional[str] = None
+
+# Company document fields the leaderboard reads
+LEADERBOARD_PROJECTION = {"_id": 0, "name": 1, "net_surplus": 1, "status": 1, "last_verified_consumption": 1,
+                          "initial_allowance": 1, "wallet_address": 1, "compliance_result": 1, "settlement_tx": 1}
+
+FIELDS_QUERY = Query(None, description="Comma-separated row fields to return, e.g. company,grade")
+
 # 6. BLOCKCHAIN HELPERS
-def mint_carbon_credits(company_wallet, amount_tons):
+async def mint_carbon_credits(company_wallet, amount_tons):
     try:
-        admin_account = w3.eth.account.from_key(PRIVATE_KEY)
-        nonce = w3.eth.get_transaction_count(admin_account.address)
-        
-        txn = contract.functions.mintCredits(
-            Web3.to_checksum_address(company_wallet), 
-            int(amount_tons)
-        ).build_transaction({
-            'chainId': 31337,
-            'gas': 200000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': nonce,
-            'from': admin_account.address
-        })
-
-        signed = w3.eth.account.sign_transaction(txn, PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(
+            contract.functions.mintCredits(
+                Web3.to_checksum_address(company_wallet), 
+                int(amount_tons)
+            ),
+            PRIVATE_KEY
+        )
+        tx_hash, receipt = await send_and_wait(signed)
         return receipt.transactionHash.hex()
     except Exception as e:
-        print(f"❌ Minting Error: {e}")
+        log.error("Minting error", extra={"wallet": company_wallet, "amount": amount_tons, "error": str(e)})
         return None
 
+async def send_and_wait(signed):
+    """Broadcasts a signed transaction, records it against the request's
+    Idempotency-Key, and blocks until its receipt"""
+    with metrics.PENDING_TRANSACTIONS.track_inprogress():
+        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
+        await idempotency.record_broadcast(tx_hash.hex())
+        with metrics.TX_RECEIPT_WAIT_SECONDS.time():
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    # Reads after this write must see at least its block
+    read_cache.observe_block(receipt.blockNumber)
+    return tx_hash, receipt
+
+def transaction_status(tx_hash):
+    """Pending, mined or reverted, for replies to retried requests"""
+    try:
+        receipt = w3.eth.get_transaction_receipt(HexBytes(tx_hash))
+    except TransactionNotFound:
+        return {"tx_hash": tx_hash, "state": "pending"}
+    return {"tx_hash": tx_hash, "state": "mined" if receipt.status == 1 else "reverted",
+            "block": receipt.blockNumber}
+
+def company_private_key(company_name):
+    return os.getenv(f"{company_name.upper().replace(' ', '_')}_PRIVATE_KEY")
+
+def sign_contract_call(contract_fn, private_key, gas=None, nonce=None):
+    """Builds and signs a contract call without sending it.
+    Fees, chain ID and (unless given) the gas limit come from caches, so the
+    only RPC here is the nonce lookup."""
+    account = w3.eth.account.from_key(private_key)
+    if nonce is None:
+        nonce = w3.eth.get_transaction_count(account.address, 'pending')
+    txn = contract_fn.build_transaction({
+        'chainId': fee_oracle.chain_id,
+        'gas': gas or gas_estimator.gas_for(contract_fn, account.address),
+        'nonce': nonce,
+        'from': account.address,
+        **fee_oracle.current()
+    })
+    return w3.eth.account.sign_transaction(txn, private_key)
+
+# Bounds concurrent OCR jobs by slots and estimated page memory (see admission.py)
+ocr_admission = OcrAdmission()
+
+# Queue depths owned by other subsystems, sampled at scrape time
+metrics.OCR_QUEUE_DEPTH.set_function(lambda: ocr_admission.stats()["queued"])
+metrics.HISTORY_QUEUE_DEPTH.set_function(lambda: history_writer.stats()["queue_depth"])
+metrics.HISTORY_LAST_FLUSH_SECONDS.set_function(lambda: history_writer.last_flush_ms / 1000)
+
+# A fast low-DPI pass is accepted when Tesseract is confident in the match;
+# otherwise the document is OCR'd again at full quality (OCR_DPI)
+OCR_FAST_DPI = int(os.getenv("OCR_FAST_DPI", "150"))
+OCR_ACCEPT_CONFIDENCE = float(os.getenv("OCR_ACCEPT_CONFIDENCE", "80"))
+
+# OCR_BACKEND=queue: how long an upload waits for a worker's result
+OCR_TASK_TIMEOUT = float(os.getenv("OCR_TASK_TIMEOUT", "120"))
+
+def ocr_passes():
+    return [OCR_FAST_DPI, OCR_DPI] if 0 < OCR_FAST_DPI < OCR_DPI else [OCR_DPI]
+
+async def run_ocr(file_path):
+    """Runs OCR off the event loop: in this process behind admission control, or
+    on an OCR worker (OCR_BACKEND=queue).
+    Returns the ExtractionResult and how long the job queued for a slot (ms)."""
+    with logs.stage("ocr"):
+        if OCR_BACKEND == "queue":
+            best, queue_wait_ms = await run_ocr_queued(file_path)
+        else:
+            best, queue_wait_ms = await run_ocr_local(file_path)
+
+        if best is None:
+            metrics.OCR_EXTRACTIONS.labels("not_found").inc()
+            log.info("No carbon figure found", extra={"file": file_path, "queue_wait_ms": queue_wait_ms})
+            raise HTTPException(status_code=422, detail="No carbon figure found in the document")
+        metrics.OCR_EXTRACTIONS.labels("fast_accepted" if best.dpi < OCR_DPI else "reocr").inc()
+        log.info("OCR finished", extra={"file": file_path, "value": best.value, "rule": best.rule,
+                                        "confidence": best.confidence, "dpi": best.dpi,
+                                        "queue_wait_ms": queue_wait_ms})
+    return best, queue_wait_ms
+
+async def run_ocr_local(file_path):
+    from ocr_engine import extract_carbon_best, ENGINE_ERRORS
+    # Admission is sized for the full-quality pass
+    cost = await asyncio.to_thread(estimate_ocr_bytes, file_path)
+    try:
+        async with ocr_admission.admit(cost) as ticket:
+            metrics.OCR_QUEUE_WAIT_SECONDS.observe(ticket["queue_wait_ms"] / 1000)
+            best = await asyncio.to_thread(
+                extract_carbon_best, file_path, ocr_passes(), OCR_ACCEPT_CONFIDENCE
+            )
+    except HTTPException as e:
+        if e.status_code == 429:
+            metrics.OCR_REJECTED.inc()
+        raise
+    except ENGINE_ERRORS as e:
+        raise HTTPException(status_code=503, detail=f"OCR engine unavailable: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not read the document: {e}")
+    return best, ticket["queue_wait_ms"]
+
+async def run_ocr_queued(file_path):
+    task_id = await ocr_queue.enqueue(file_path, ocr_passes(), OCR_ACCEPT_CONFIDENCE,
+                                      request_id=logs.request_id_var.get())
+    task = await ocr_queue.wait(task_id, OCR_TASK_TIMEOUT)
+    if task is None:
+        await ocr_queue.cancel(task_id)
+        raise HTTPException(status_code=504, detail=f"No OCR worker finished the document within {OCR_TASK_TIMEOUT:.0f}s")
+
+    queue_wait_ms = round((task["leased_at"] - task["created_at"]).total_seconds() * 1000, 1)
+    metrics.OCR_QUEUE_WAIT_SECONDS.observe(queue_wait_ms / 1000)
+    if task["state"] == "failed":
+        if task.get("error_kind") in ("engine", "lease_expired"):
+            raise HTTPException(status_code=503, detail=f"OCR engine unavailable: {task.get('error')}")
+        raise HTTPException(status_code=422, detail=f"Could not read the document: {task.get('error')}")
+    result = task["result"]
+    return (ExtractionResult(**result) if result else None), queue_wait_ms
+
 # 7. ROUTES
 
 @app.post("/phase1-minting/{company_name}")
-async def register_and_mint(company_name: str, wallet_address: str, file: UploadFile = File(...)):
+async def register_and_mint(
+    company_name: str,
+    wallet_address: str,
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Phase 1: OCR Registration and Initial Minting"""
+    logs.bind(company_name)
+    return await idempotency.run(
+        idempotency_key, f"phase1-minting:{company_name}",
+        {"wallet_address": wallet_address, "filename": file.filename, "size": file.size},
+        lambda: _register_and_mint(company_name, wallet_address, file),
+        # A mint that failed before broadcast comes back as tx None; let the retry mint again
+        cacheable=lambda response: response.get("blockchain_tx") is not None
+    )
+
+async def _register_and_mint(company_name, wallet_address, file):
     file_path = f"uploads/reg_{file.filename}"
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    from ocr_engine import extract_carbon_value
-    tons_detected = extract_carbon_value(file_path)
+    match, queue_wait_ms = await run_ocr(file_path)
+    tons_detected = int(match.value)
 
-    tx_hash = mint_carbon_credits(wallet_address, tons_detected)
+    tx_hash = await mint_carbon_credits(wallet_address, tons_detected)
 
     await companies_col.update_one(
         {"name": company_name},
@@ -126,13 +507,16 @@ async def register_and_mint(company_name: str, wallet_address: str, file: Upload
         "status": "SUCCESS", 
         "company": company_name, 
         "tons_allocated": tons_detected, 
-        "blockchain_tx": tx_hash
+        "blockchain_tx": tx_hash,
+        "ocr_match": asdict(match),
+        "ocr_queue_wait_ms": queue_wait_ms
     }
 
 @app.post("/phase2-settlement/{company_name}")
 async def verify_and_settle(company_name: str, file: UploadFile = File(...)):
     """Phase 2: Merged Audit Logic - Updates DB immediately and attempts burn"""
-    
+    logs.bind(company_name)
+
     # 1. AUTHENTICATION & FILE HANDLING
     company_data = await companies_col.find_one({"name": company_name})
     if not company_data:
@@ -142,8 +526,8 @@ async def verify_and_settle(company_name: str, file: UploadFile = File(...)):
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
-    from ocr_engine import extract_carbon_value
-    actual_consumption = extract_carbon_value(file_path)
+    match, queue_wait_ms = await run_ocr(file_path)
+    actual_consumption = int(match.value)
     
     # 2. CALCULATION LOGIC (Teammate's contribution)
     allowance = company_data.get("initial_allowance", 0)
@@ -154,7 +538,11 @@ async def verify_and_settle(company_name: str, file: UploadFile = File(...)):
     required_burn = int(actual_consumption + penalty)
     
     # Check current on-chain balance
-    current_balance = contract.functions.balanceOf(company_wallet).call()
+    current_balance = read_cache.call(contract.functions.balanceOf(company_wallet))
+    if current_balance < required_burn:
+        # Tokens bought in a block this worker hasn't seen yet? Check the latest
+        # before a deficit is stored and shown on the leaderboard
+        current_balance = read_cache.call(contract.functions.balanceOf(company_wallet), fresh=True)
     deficit = max(0, required_burn - current_balance)
     surplus = allowance - required_burn
 
@@ -179,25 +567,17 @@ async def verify_and_settle(company_name: str, file: UploadFile = File(...)):
             "message": f"Audit recorded. You need {deficit} more tokens to settle.",
             "net_surplus": surplus,
             "required_burn": required_burn,
-            "action_required": "Buy tokens from marketplace to clear your B-Grade status"
+            "action_required": "Buy tokens from marketplace to clear your B-Grade status",
+            "suggested_fill": order_book.cheapest_fill(deficit),
+            "ocr_match": asdict(match),
+            "ocr_queue_wait_ms": queue_wait_ms
         }
 
     try:
         # If no deficit, proceed to burn
         company_key = os.getenv(f"{company_name.upper()}_PRIVATE_KEY")
-        company_account = w3.eth.account.from_key(company_key)
-
-        txn = contract.functions.retireCredits(required_burn).build_transaction({
-            'chainId': 31337,
-            'gas': 250000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': w3.eth.get_transaction_count(company_account.address),
-            'from': company_account.address
-        })
-
-        signed = w3.eth.account.sign_transaction(txn, company_key)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(contract.functions.retireCredits(required_burn), company_key)
+        tx_hash, _ = await send_and_wait(signed)
 
         # Final Update on Success
         await companies_col.update_one(
@@ -209,21 +589,34 @@ async def verify_and_settle(company_name: str, file: UploadFile = File(...)):
             "status": "SETTLEMENT_SUCCESS",
             "company": company_name,
             "blockchain_tx": tx_hash.hex(),
-            "net_surplus": surplus
+            "net_surplus": surplus,
+            "ocr_match": asdict(match),
+            "ocr_queue_wait_ms": queue_wait_ms
         }
 
     except Exception as e:
         return {
             "status": "BLOCKCHAIN_DELAY",
             "message": "Audit saved, but blockchain call failed.",
-            "details": str(e)
+            "details": str(e),
+            "ocr_match": asdict(match),
+            "ocr_queue_wait_ms": queue_wait_ms
         }
 
 
 @app.post("/finalize-settlement/{company_name}")
-async def finalize_settlement(company_name: str):
+async def finalize_settlement(
+    company_name: str,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Re-attempts the burn using data already saved in MongoDB"""
-    
+    logs.bind(company_name)
+    return await idempotency.run(
+        idempotency_key, f"finalize-settlement:{company_name}", {},
+        lambda: _finalize_settlement(company_name)
+    )
+
+async def _finalize_settlement(company_name):
     company_data = await companies_col.find_one({"name": company_name})
     if not company_data or company_data.get("status") != "deficit":
         return {"status": "ERROR", "message": "No active debt found for this company."}
@@ -233,28 +626,21 @@ async def finalize_settlement(company_name: str):
 
     try:
         # 1. Check if they actually bought the tokens yet
-        current_balance = contract.functions.balanceOf(company_wallet).call()
+        current_balance = read_cache.call(contract.functions.balanceOf(company_wallet))
+        if current_balance < required_burn:
+            # Confirm against the latest block before telling them to buy more
+            current_balance = read_cache.call(contract.functions.balanceOf(company_wallet), fresh=True)
         if current_balance < required_burn:
             return {
                 "status": "STILL_IN_DEBT",
-                "message": f"You still need {required_burn - current_balance} more tokens."
+                "message": f"You still need {required_burn - current_balance} more tokens.",
+                "suggested_fill": order_book.cheapest_fill(required_burn - current_balance)
             }
 
         # 2. Execute the Burn (now that they have enough)
         company_key = os.getenv(f"{company_name.upper()}_PRIVATE_KEY")
-        company_account = w3.eth.account.from_key(company_key)
-
-        txn = contract.functions.retireCredits(required_burn).build_transaction({
-            'chainId': 31337,
-            'gas': 250000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': w3.eth.get_transaction_count(company_account.address),
-            'from': company_account.address
-        })
-
-        signed = w3.eth.account.sign_transaction(txn, company_key)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(contract.functions.retireCredits(required_burn), company_key)
+        tx_hash, _ = await send_and_wait(signed)
 
         # 3. Update status to Success
         await companies_col.update_one(
@@ -271,19 +657,20 @@ async def finalize_settlement(company_name: str):
 # CORRECTED MARKETPLACE ENDPOINTS
 # ============================================
 
-@app.get("/marketplace/listings")
-async def get_active_listings():
+@app.get("/marketplace/listings", response_model=ListingsResponse, response_class=ORJSONResponse)
+async def get_active_listings(fields: Optional[str] = FIELDS_QUERY):
     """Get all active marketplace listings"""
+    selected = responses.parse_fields(fields, ListingRow)
     try:
-        next_id = contract.functions.nextListingId().call()
+        next_id = read_cache.call(contract.functions.nextListingId())
         listings = []
         
         for i in range(next_id):
-            listing = contract.functions.marketListings(i).call()
+            listing = read_cache.call(contract.functions.marketListings(i))
             if listing[6]:  # active flag at index 6
                 # Find company name for seller
                 seller_company = await companies_col.find_one(
-                    {"wallet_address": listing[1].lower()}  # seller address at index 1
+                    wallet_query(listing[1])  # seller address at index 1
                 )
                 company_name = seller_company["name"] if seller_company else "Unknown"
                 
@@ -298,18 +685,46 @@ async def get_active_listings():
                     "active": listing[6]
                 })
         
-        return {"status": "SUCCESS", "listings": listings}
+        return ORJSONResponse({"status": "SUCCESS", "listings": responses.project(listings, selected)})
     except Exception as e:
-        return {"status": "ERROR", "message": str(e)}
+        return ORJSONResponse({"status": "ERROR", "message": str(e)})
 
 @app.post("/marketplace/list-with-price")
 async def list_with_price(
     company_name: str = Query(...),
     amount: int = Query(...),
     price: int = Query(...),
-    qr_url: str = Query(...)
+    qr_url: str = Query(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """List tokens for sale with price and QR code URL"""
+    logs.bind(company_name)
+    return await idempotency.run(
+        idempotency_key, f"list-with-price:{company_name}",
+        {"amount": amount, "price": price, "qr_url": qr_url},
+        lambda: _list_with_price(company_name, amount, price, qr_url)
+    )
+
+# Listing IDs resolved by this process's list-with-price calls. Not the order
+# book: the block sync may add a new listing before its route resolves it.
+claimed_listing_ids = set()
+
+def resolve_new_listing(receipt, seller, amount, price, qr_url):
+    """nextListingId() - 1 can belong to another seller when listings race, so scan
+    the IDs created in the receipt's block (state before vs. at that block) for ours"""
+    block = receipt.blockNumber
+    first = contract.functions.nextListingId().call(block_identifier=block - 1)
+    last = contract.functions.nextListingId().call(block_identifier=block)
+    for listing_id in range(first, last):
+        if listing_id in claimed_listing_ids:
+            continue  # already claimed by a concurrent identical listing
+        listing = contract.functions.marketListings(listing_id).call(block_identifier=block)
+        if (listing[1].lower(), listing[2], listing[3], listing[4]) == (seller.lower(), amount, price, qr_url):
+            claimed_listing_ids.add(listing_id)
+            return listing_id, listing
+    raise RuntimeError(f"Listing not found among IDs {first}..{last - 1} created in block {block}")
+
+async def _list_with_price(company_name, amount, price, qr_url):
     try:
         # Get company private key
         env_key = f"{company_name.upper().replace(' ', '_')}_PRIVATE_KEY"
@@ -324,30 +739,25 @@ async def list_with_price(
         company_account = w3.eth.account.from_key(company_key)
         
         # ✅ CORRECT: Call listWithPrice(amount, price, qrUrl)
-        txn = contract.functions.listWithPrice(
-            amount,
-            price,
-            qr_url
-        ).build_transaction({
-            'chainId': 31337,
-            'gas': 300000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': w3.eth.get_transaction_count(company_account.address),
-            'from': company_account.address
-        })
-
-        signed = w3.eth.account.sign_transaction(txn, company_key)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(
+            contract.functions.listWithPrice(amount, price, qr_url),
+            company_key
+        )
+        tx_hash, receipt = await send_and_wait(signed)
         
-        # Get the new listing ID
-        listing_id = contract.functions.nextListingId().call() - 1
+        # Find our listing in the receipt's block, as stored on-chain
+        listing_id, listing = resolve_new_listing(receipt, company_account.address, amount, price, qr_url)
+        order_book.add(
+            listing_id, listing[1], listing[2], listing[3], listing[4],
+            seller_company=company_name
+        )
         
         # Log to history
-        await history_col.insert_one({
+        history_writer.record({
             "timestamp": datetime.utcnow(),
             "type": "MARKETPLACE_LIST",
             "company": company_name,
+            "companies": [company_name],
             "amount": amount,
             "price": price,
             "listing_id": listing_id,
@@ -364,7 +774,7 @@ async def list_with_price(
         
     except Exception as e:
         error_msg = str(e)
-        print(f"Marketplace list error: {error_msg}")
+        market_log.warning("Marketplace list error", extra={"company": company_name, "error": error_msg})
         return {"status": "ERROR", "message": error_msg}
 
 @app.post("/marketplace/mark-paid/{listing_id}")
@@ -373,6 +783,7 @@ async def mark_as_paid(
     buyer_company: str = Query(...)
 ):
     """Buyer marks listing as paid after scanning QR code"""
+    logs.bind(buyer_company)
     try:
         # Get buyer's private key
         buyer_key = os.getenv(f"{buyer_company.upper().replace(' ', '_')}_PRIVATE_KEY")
@@ -382,26 +793,19 @@ async def mark_as_paid(
                 "message": f"Private key for buyer {buyer_company} not found"
             }
         
-        buyer_account = w3.eth.account.from_key(buyer_key)
-        
         # ✅ CORRECT: Call markAsPaid(listingId)
-        txn = contract.functions.markAsPaid(listing_id).build_transaction({
-            'chainId': 31337,
-            'gas': 200000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': w3.eth.get_transaction_count(buyer_account.address),
-            'from': buyer_account.address
-        })
-        
-        signed = w3.eth.account.sign_transaction(txn, buyer_key)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(contract.functions.markAsPaid(listing_id), buyer_key)
+        tx_hash, receipt = await send_and_wait(signed)
+
+        # A paid listing is spoken for, so it leaves the order book
+        order_book.remove(listing_id)
         
         # Log to history
-        await history_col.insert_one({
+        history_writer.record({
             "timestamp": datetime.utcnow(),
             "type": "MARKETPLACE_MARK_PAID",
             "buyer_company": buyer_company,
+            "companies": [buyer_company],
             "listing_id": listing_id,
             "tx_hash": tx_hash.hex(),
             "status": "marked_paid"
@@ -415,7 +819,7 @@ async def mark_as_paid(
         
     except Exception as e:
         error_msg = str(e)
-        print(f"Mark paid error: {error_msg}")
+        market_log.warning("Mark paid error", extra={"listing_id": listing_id, "error": error_msg})
         return {"status": "ERROR", "message": error_msg}
 
 @app.post("/marketplace/release/{listing_id}")
@@ -426,7 +830,10 @@ async def release_tokens(
     """Seller releases tokens to buyer after payment verification"""
     try:
         # Get listing info to find seller
-        listing = contract.functions.marketListings(listing_id).call()
+        listing = read_cache.call(contract.functions.marketListings(listing_id))
+        if not (listing[6] and listing[5]):
+            # Paid in a block this worker hasn't seen yet? Check the latest before refusing
+            listing = read_cache.call(contract.functions.marketListings(listing_id), fresh=True)
         seller_wallet = listing[1]  # seller address at index 1
         amount = listing[2]  # amount at index 2
         
@@ -436,11 +843,8 @@ async def release_tokens(
         if not listing[5]:  # is_paid flag at index 5
             return {"status": "ERROR", "message": "Buyer hasn't marked as paid yet"}
         
-        # Find seller company
-       # ✅ Corrected logic (Handles both casing styles)
-        seller_company = await companies_col.find_one(
-        {"wallet_address": {"$regex": f"^{seller_wallet}$", "$options": "i"}}
-)
+        # Find seller company (handles both casing styles)
+        seller_company = await companies_col.find_one(wallet_query(seller_wallet))
         if not seller_company:
             return {"status": "ERROR", "message": "Seller company not found in database"}
         
@@ -449,42 +853,33 @@ async def release_tokens(
         if not seller_key:
             return {"status": "NO_KEY", "message": f"Private key for seller {company_name} not found"}
         
-        seller_account = w3.eth.account.from_key(seller_key)
-        
         # ✅ CORRECT: Call releaseTokens(listingId, buyerAddress)
-        txn = contract.functions.releaseTokens(
-            listing_id,
-            Web3.to_checksum_address(buyer_wallet)
-        ).build_transaction({
-            'chainId': 31337,
-            'gas': 300000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': w3.eth.get_transaction_count(seller_account.address),
-            'from': seller_account.address
-        })
-        
-        signed = w3.eth.account.sign_transaction(txn, seller_key)
-        tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        signed = sign_contract_call(
+            contract.functions.releaseTokens(listing_id, Web3.to_checksum_address(buyer_wallet)),
+            seller_key
+        )
+        tx_hash, receipt = await send_and_wait(signed)
+        order_book.remove(listing_id)
         
         # Find buyer company and update their allowance
-        buyer_company = await companies_col.find_one(
-            {"wallet_address": buyer_wallet.lower()}
-        )
+        buyer_company = await companies_col.find_one(wallet_query(buyer_wallet))
         if buyer_company:
             await companies_col.update_one(
                 {"name": buyer_company["name"]},
                 {"$inc": {"initial_allowance": amount}}
             )
-        
+        involved = [company_name] + ([buyer_company["name"]] if buyer_company else [])
+
         # Log to history
-        await history_col.insert_one({
+        history_writer.record({
             "timestamp": datetime.utcnow(),
             "type": "MARKETPLACE_RELEASE",
             "seller_company": company_name,
             "buyer_wallet": buyer_wallet,
+            "companies": involved,
             "listing_id": listing_id,
             "amount": amount,
+            "price": listing[3],
             "tx_hash": tx_hash.hex(),
             "status": "released"
         })
@@ -497,7 +892,152 @@ async def release_tokens(
         
     except Exception as e:
         error_msg = str(e)
-        print(f"Release tokens error: {error_msg}")
+        market_log.warning("Release tokens error", extra={"listing_id": listing_id, "error": error_msg})
+        return {"status": "ERROR", "message": error_msg}
+
+@app.get("/marketplace/order-book")
+async def get_order_book(limit: int = Query(10, ge=1, le=500)):
+    """Cheapest open listings first"""
+    return {"status": "SUCCESS", "listings": order_book.cheapest(limit)}
+
+@app.get("/marketplace/order-book/covering")
+async def get_covering_listings(amount: int = Query(..., ge=1), limit: int = Query(10, ge=1, le=500)):
+    """Cheapest open listings that each hold at least `amount` tokens"""
+    return {"status": "SUCCESS", "listings": order_book.covering(amount, limit)}
+
+@app.get("/marketplace/order-book/fill")
+async def get_cheapest_fill(amount: int = Query(..., ge=1)):
+    """Cheapest set of listings that together cover `amount` tokens"""
+    return {"status": "SUCCESS", **order_book.cheapest_fill(amount)}
+
+@app.post("/marketplace/execute-trade/{listing_id}")
+async def execute_trade(
+    listing_id: int,
+    buyer_company: str = Query(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Marks a listing as paid and releases it to the buyer in one call"""
+    logs.bind(buyer_company)
+    return await idempotency.run(
+        idempotency_key, f"execute-trade:{listing_id}", {"buyer_company": buyer_company},
+        lambda: _execute_trade(listing_id, buyer_company)
+    )
+
+async def _execute_trade(listing_id, buyer_company):
+    try:
+        # 1. Resolve the listing on-chain (cached per block); the order book entry
+        # only contributes the seller's company name, and only if it matches
+        raw = read_cache.call(contract.functions.marketListings(listing_id))
+        if not raw[6] or raw[5]:
+            raw = read_cache.call(contract.functions.marketListings(listing_id), fresh=True)
+        if not raw[6]:
+            order_book.remove(listing_id)
+            return {"status": "ERROR", "message": "Listing is not active"}
+        if raw[5]:
+            order_book.remove(listing_id)
+            return {"status": "ERROR", "message": "Listing is already paid, use /marketplace/release"}
+        listing = order_book.get(listing_id)
+        if listing and (listing["seller_wallet"].lower(), listing["amount"], listing["price_per_token"]) \
+                != (raw[1].lower(), raw[2], raw[3]):
+            # The book was wrong about this listing: fix it and let the buyer re-check the offer
+            seller_doc = await companies_col.find_one(wallet_query(raw[1]))
+            order_book.add(listing_id, raw[1], raw[2], raw[3], raw[4],
+                           seller_company=seller_doc["name"] if seller_doc else "Unknown")
+            return {"status": "STALE_LISTING",
+                    "message": f"Listing #{listing_id} is {raw[2]} tokens at {raw[3]} each from {raw[1]}; please retry"}
+        if listing is None:
+            listing = {"seller_wallet": raw[1], "amount": raw[2], "price_per_token": raw[3],
+                       "seller_company": "Unknown"}
+        seller_wallet, amount = raw[1], raw[2]
+
+        # 2. Resolve both parties' keys
+        seller_name = listing["seller_company"]
+        if seller_name == "Unknown":
+            seller_doc = await companies_col.find_one(wallet_query(seller_wallet))
+            if not seller_doc:
+                return {"status": "ERROR", "message": "Seller company not found in database"}
+            seller_name = seller_doc["name"]
+        seller_key = company_private_key(seller_name)
+        if not seller_key:
+            return {"status": "NO_KEY", "message": f"Private key for seller {seller_name} not found"}
+        buyer_key = company_private_key(buyer_company)
+        if not buyer_key:
+            return {"status": "NO_KEY", "message": f"Private key for buyer {buyer_company} not found"}
+        buyer_wallet = w3.eth.account.from_key(buyer_key).address
+
+        # 3. Sign both legs up front, then broadcast back-to-back so they can share a block.
+        # releaseTokens cannot be gas-estimated before markAsPaid lands, so it uses the
+        # cached estimate from an earlier release, or a fixed limit.
+        paid_signed = sign_contract_call(contract.functions.markAsPaid(listing_id), buyer_key)
+        release_fn = contract.functions.releaseTokens(listing_id, buyer_wallet)
+        release_gas = gas_estimator.peek(release_fn, 300000)
+        release_signed = sign_contract_call(release_fn, seller_key, release_gas)
+
+        metrics.PENDING_TRANSACTIONS.inc(2)
+        try:
+            paid_hash = w3.eth.send_raw_transaction(paid_signed.raw_transaction)
+            release_hash = w3.eth.send_raw_transaction(release_signed.raw_transaction)
+            await idempotency.record_broadcast(paid_hash.hex())
+            await idempotency.record_broadcast(release_hash.hex())
+            with metrics.TX_RECEIPT_WAIT_SECONDS.time():
+                paid_receipt = w3.eth.wait_for_transaction_receipt(paid_hash)
+                release_receipt = w3.eth.wait_for_transaction_receipt(release_hash)
+        finally:
+            metrics.PENDING_TRANSACTIONS.dec(2)
+        read_cache.observe_block(max(paid_receipt.blockNumber, release_receipt.blockNumber))
+        if paid_receipt.status != 1:
+            return {"status": "ERROR", "message": "markAsPaid reverted", "tx_hash": paid_hash.hex()}
+        # The listing is paid on-chain from here on, whatever happens to the release
+        order_book.remove(listing_id)
+        now = datetime.utcnow()
+        history_writer.record({
+            "timestamp": now,
+            "type": "MARKETPLACE_MARK_PAID",
+            "buyer_company": buyer_company,
+            "companies": [buyer_company],
+            "listing_id": listing_id,
+            "tx_hash": paid_hash.hex(),
+            "status": "marked_paid"
+        })
+        if release_receipt.status != 1:
+            # The node ordered the release ahead of the payment; retry now that it is paid
+            release_hash, release_receipt = await send_and_wait(
+                sign_contract_call(release_fn, seller_key, release_gas)
+            )
+            if release_receipt.status != 1:
+                return {"status": "ERROR", "message": "releaseTokens reverted; the listing is paid, "
+                                                      "the seller can release it with /marketplace/release",
+                        "mark_paid_tx": paid_hash.hex(), "tx_hash": release_hash.hex()}
+
+        # 4. Allowance and history, once per trade
+        await companies_col.update_one(
+            {"name": buyer_company},
+            {"$inc": {"initial_allowance": amount}}
+        )
+        history_writer.record({
+            "timestamp": now,
+            "type": "MARKETPLACE_RELEASE",
+            "seller_company": seller_name,
+            "buyer_wallet": buyer_wallet,
+            "companies": [seller_name, buyer_company],
+            "listing_id": listing_id,
+            "amount": amount,
+            "price": listing["price_per_token"],
+            "tx_hash": release_hash.hex(),
+            "status": "released"
+        })
+
+        return {
+            "status": "TRADED",
+            "mark_paid_tx": paid_hash.hex(),
+            "tx_hash": release_hash.hex(),
+            "same_block": paid_receipt.blockNumber == release_receipt.blockNumber,
+            "message": f"Successfully traded {amount} tokens from {seller_name} to {buyer_company}"
+        }
+
+    except Exception as e:
+        error_msg = str(e)
+        market_log.warning("Execute trade error", extra={"listing_id": listing_id, "error": error_msg})
         return {"status": "ERROR", "message": error_msg}
 
 # ============================================
@@ -531,10 +1071,11 @@ async def buy_credits(request: BuyRequest):
         "suggestion": "Use marketplace workflow: 1. /marketplace/list-with-price, 2. /marketplace/mark-paid, 3. /marketplace/release"
     }
 
-@app.get("/leaderboard")
-async def get_rankings():
+@app.get("/leaderboard", response_model=LeaderboardResponse, response_class=ORJSONResponse)
+async def get_rankings(fields: Optional[str] = FIELDS_QUERY):
     """Returns leaderboard with Reputation Grades"""
-    cursor = companies_col.find().sort("initial_allowance", -1)
+    selected = responses.parse_fields(fields, LeaderboardRow)
+    cursor = companies_col.find({}, LEADERBOARD_PROJECTION).sort("initial_allowance", -1)
     rankings = []
     async for doc in cursor:
         allowance = doc.get("initial_allowance", 0)
@@ -560,4 +1101,120 @@ async def get_rankings():
             "compliance_result": doc.get("compliance_result", "N/A"),
             "settlement_tx": doc.get("settlement_tx", "N/A")
         })
-    return {"leaderboard": rankings}
\ No newline at end of file
+    return ORJSONResponse({"leaderboard": responses.project(rankings, selected)})
+
+@app.get("/logs/stats")
+async def log_stats():
+    """Log queue depth plus records dropped, sampled out and rate limited"""
+    return logs.stats()
+
+@app.get("/history/writer-stats")
+async def history_writer_stats():
+    """Queue depth and flush latency of the buffered history writer"""
+    return history_writer.stats()
+
+
+@app.get("/history")
+async def get_history(
+    company: Optional[str] = None,
+    type: Optional[str] = None,
+    listing_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=history.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Transaction history, newest first, keyset-paginated on (timestamp, _id)"""
+    try:
+        events, next_cursor = await history.query_history(
+            history_col, limit=limit, company=company, event_type=type,
+            listing_id=listing_id, start=start, end=end, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "SUCCESS", "events": events, "next_cursor": next_cursor}
+
+
+@app.get("/history/rollups")
+async def get_history_rollups(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    type: Optional[str] = None
+):
+    """Daily volume, count and average price per event type"""
+    try:
+        rollups = await history.query_rollups(rollups_col, start=start, end=end, event_type=type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "SUCCESS", "rollups": rollups}
+
+
+@app.get("/rpc/status")
+async def rpc_status():
+    """Health and read latency of each RPC endpoint, plus view-call cache hit rates"""
+    return {"endpoints": w3.provider.stats(), "read_cache": read_cache.stats()}
+
+
+@app.get("/ocr/admission")
+async def ocr_admission_stats():
+    """OCR slots, memory budget, queue depth and wait times"""
+    return ocr_admission.stats()
+
+
+@app.get("/ocr/tasks")
+async def ocr_task_stats():
+    """OCR task queue depth by state (OCR_BACKEND=queue)"""
+    return {"backend": OCR_BACKEND, **(await ocr_queue.stats())}
+
+
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    Readiness probe: 200 once every startup check passed, 503 with the failures
+    otherwise. Failed checks are re-run, at most every READY_RECHECK_INTERVAL.
+    """
+    now = asyncio.get_running_loop().time()
+    stale = [component for component, check in readiness.items()
+             if not check["ok"] and now - checked_at[component] >= READY_RECHECK_INTERVAL]
+    for component in stale:
+        checked_at[component] = now  # concurrent probes don't re-run it too
+    if stale:
+        await asyncio.gather(*(startup_check(component, startup_checks[component]) for component in stale))
+    is_ready = bool(readiness) and all(check["ok"] for check in readiness.values())
+    if not is_ready:
+        response.status_code = 503
+    return {"ready": is_ready, "checks": readiness}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+def require_admin(token):
+    if not profiler.ADMIN_TOKEN or token != profiler.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Saved request profiles, newest first"""
+    require_admin(x_admin_token)
+    return {"profiles": await asyncio.to_thread(profile_store.list)}
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "speedscope", kind: str = "wall",
+                      x_admin_token: Optional[str] = Header(None)):
+    """speedscope JSON (open at speedscope.app), or format=folded for flamegraph.pl"""
+    require_admin(x_admin_token)
+    speedscope = await asyncio.to_thread(profile_store.load, profile_id)
+    if speedscope is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        if kind not in ("wall", "cpu"):
+            raise HTTPException(status_code=400, detail="kind must be wall or cpu")
+        return Response(content=profiler.to_folded(speedscope, kind), media_type="text/plain")
+    return speedscope
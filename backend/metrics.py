@@ -0,0 +1,124 @@
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+
+# Prometheus metrics for the hot paths: OCR stages, RPC methods, Mongo
+# operations and HTTP routes. Scraped from GET /metrics.
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# --- OCR ---
+OCR_STAGE_SECONDS = Histogram(
+    "ocr_stage_seconds", "Time spent in each extract_carbon_value stage",
+    ["stage"], buckets=SLOW_BUCKETS
+)
+OCR_JOBS_IN_FLIGHT = Gauge("ocr_jobs_in_flight", "OCR jobs currently running")
+OCR_QUEUE_WAIT_SECONDS = Histogram(
+    "ocr_queue_wait_seconds", "Time OCR jobs waited for an admission slot", buckets=SLOW_BUCKETS
+)
+OCR_REJECTED = Counter("ocr_rejected_total", "OCR jobs rejected with 429")
+OCR_QUEUE_DEPTH = Gauge("ocr_queue_depth", "OCR jobs waiting for a slot")
+OCR_EXTRACTIONS = Counter(
+    "ocr_extractions_total", "Documents by outcome: fast_accepted, reocr or not_found", ["outcome"]
+)
+
+# --- RPC ---
+RPC_REQUEST_SECONDS = Histogram(
+    "rpc_request_seconds", "JSON-RPC request latency by method (eth_call by contract function)",
+    ["method"], buckets=FAST_BUCKETS
+)
+RPC_ERRORS = Counter("rpc_errors_total", "JSON-RPC requests that failed or returned an error", ["method"])
+PENDING_TRANSACTIONS = Gauge("pending_transactions", "Transactions sent and awaiting a receipt")
+TX_RECEIPT_WAIT_SECONDS = Histogram(
+    "tx_receipt_wait_seconds", "Time from broadcast to receipt", buckets=SLOW_BUCKETS
+)
+
+# --- MONGO ---
+MONGO_OPERATION_SECONDS = Histogram(
+    "mongo_operation_seconds", "MongoDB command latency by collection and operation",
+    ["collection", "operation"], buckets=FAST_BUCKETS
+)
+MONGO_FAILURES = Counter("mongo_failures_total", "Failed MongoDB commands", ["collection", "operation"])
+
+# --- HISTORY WRITER ---
+HISTORY_QUEUE_DEPTH = Gauge("history_queue_depth", "History events buffered in memory")
+HISTORY_LAST_FLUSH_SECONDS = Gauge("history_last_flush_seconds", "Duration of the last history flush")
+
+# --- HTTP ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Request latency by route template",
+    ["method", "route", "status"], buckets=SLOW_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+
+
+def stage_timer(stage):
+    """with stage_timer("tesseract"): ..."""
+    return OCR_STAGE_SECONDS.labels(stage).time()
+
+
+def render():
+    """Body and content type for the /metrics endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends; pass in event_listeners=[...]"""
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        # The first key of a command is its name; its value is the collection
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "-"
+        self._started[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finish(self, event, failed):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            return
+        MONGO_OPERATION_SECONDS.labels(*labels).observe(event.duration_micros / 1e6)
+        if failed:
+            MONGO_FAILURES.labels(*labels).inc()
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording latency per route template (not per raw path)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
@@ -1,10 +1,26 @@
 import pytesseract
 from pdf2image import convert_from_path
+from pdf2image.exceptions import PDFInfoNotInstalledError
 import re
 import cv2
 import numpy as np
 import shutil
 import os
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import logs
+from ocr_result import ExtractionResult  # re-exported
+from metrics import stage_timer, OCR_JOBS_IN_FLIGHT, OCR_STAGE_SECONDS
+
+log = logs.get_logger("ocr")
+
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))  # pdf2image's default; keep in sync with admission.py
+# Worker processes that OCR pages in parallel; 0 keeps OCR in the calling thread
+OCR_PROCESSES = int(os.getenv("OCR_PROCESSES", "0"))
 
 # 1. Mac Tesseract Path Configuration
 # This ensures Python finds the Homebrew installation of Tesseract
@@ -15,56 +31,285 @@ else:
     # Common Mac Homebrew path fallback
     pytesseract.pytesseract.tesseract_cmd = r'/opt/homebrew/bin/tesseract'
 
+# 2. FIELD EXTRACTION
+# One pass per OCR line. Alternatives, strongest first:
+#   key_unit: "Allowance: 500 tons"   key: "Total: 1000"   unit: "250 tCO2e"
+FIELD_PATTERN = re.compile(
+    r'(?P<key>allowance|value|total|carbon|verified)\s*[:\-]?\s*(?P<key_value>\d+(?:\.\d+)?)'
+    r'(?:\s*(?P<key_unit>tons|tCO2e|tonnes|credits|CCT)\b)?'
+    r'|(?P<unit_value>\d+(?:\.\d+)?)\s*(?P<unit>tons|tCO2e|tonnes|credits|CCT)\b',
+    re.IGNORECASE
+)
+RULE_PRIORITY = {"key_unit": 3, "key": 2, "unit": 1}
+# Reports list line items ("Scope 1 Emissions: 350.5 tons") above their total
+# ("TOTAL CARBON EMISSIONS: 600.0 tons"); both match the same rule
+TOTAL_PATTERN = re.compile(r'\btotal\b', re.IGNORECASE)
+
+# Missing binaries: the server's fault, not the document's
+ENGINE_ERRORS = (PDFInfoNotInstalledError, pytesseract.TesseractNotFoundError)
+
+def _lines(data):
+    """Groups image_to_data words into lines: [(text, [(start, end, word index)])]"""
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(i)
+    for indexes in lines.values():
+        text, spans = "", []
+        for i in indexes:
+            if text:
+                text += " "
+            spans.append((len(text), len(text) + len(data["text"][i]), i))
+            text += data["text"][i]
+        yield text, spans
+
+def _candidate(match, text, spans, data, page, dpi):
+    if match.group("key_value") is not None:
+        rule = "key_unit" if match.group("key_unit") else "key"
+        value, unit = match.group("key_value"), match.group("key_unit")
+    else:
+        rule, value, unit = "unit", match.group("unit_value"), match.group("unit")
+
+    words = [i for start, end, i in spans if start < match.end() and end > match.start()]
+    left = min(data["left"][i] for i in words)
+    top = min(data["top"][i] for i in words)
+    right = max(data["left"][i] + data["width"][i] for i in words)
+    bottom = max(data["top"][i] + data["height"][i] for i in words)
+    return ExtractionResult(
+        value=float(value), unit=unit.lower() if unit else None, page=page,
+        bbox=(left, top, right - left, bottom - top),
+        confidence=min(float(data["conf"][i]) for i in words),
+        rule=rule, text=" ".join(data["text"][i] for i in words), dpi=dpi,
+        total=bool(TOTAL_PATTERN.search(text))
+    )
+
+def best_match(pages, dpi):
+    """Strongest rule wins (see _stronger); None when nothing matched"""
+    best = None
+    for page, data in enumerate(pages, start=1):
+        for text, spans in _lines(data):
+            for match in FIELD_PATTERN.finditer(text):
+                candidate = _candidate(match, text, spans, data, page, dpi)
+                if _stronger(candidate, best):
+                    best = candidate
+    return best
+
+def extract_carbon_result(pdf_path, dpi=OCR_DPI):
+    """
+    OCRs a PDF at `dpi` and returns the best carbon figure as an
+    ExtractionResult, or None if no field matched. OCR failures raise.
+    """
+    with OCR_JOBS_IN_FLIGHT.track_inprogress():
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(pdf_path)
+        started = time.perf_counter()
+
+        # 3. Convert PDF to grayscale PGM files (one byte per pixel, no PIL copies)
+        # pdf2image has no "pgm" format: "ppm" with grayscale=True writes .pgm files
+        # Note: If this fails, ensure 'brew install poppler' is run
+        with tempfile.TemporaryDirectory() as raster_dir:
+            with stage_timer("rasterize"):
+                page_paths = convert_from_path(
+                    pdf_path, dpi=dpi, grayscale=True, fmt="ppm",
+                    output_folder=raster_dir, paths_only=True
+                )
+            if not page_paths:
+                raise ValueError(f"No pages rasterized from {pdf_path}")
+
+            # 4. Threshold + OCR, here or in the worker pool
+            if OCR_PROCESSES > 0:
+                pages = _ocr_pages_in_pool(page_paths)
+            else:
+                pages = [_ocr_page(_read_pgm(path)) for path in page_paths]
+
+        with stage_timer("regex"):
+            result = best_match(pages, dpi)
+        log.debug("OCR pass", extra={
+            "file": pdf_path, "dpi": dpi, "pages": len(pages),
+            "pass_ms": round((time.perf_counter() - started) * 1000, 1),
+            "value": result.value if result else None,
+            "rule": result.rule if result else None,
+            "page": result.page if result else None,
+            "confidence": result.confidence if result else None,
+        })
+        return result
+
+def _strength(result):
+    # Within a rule: a figure on a "total" line, then the largest figure (a
+    # total is at least each of its items), and only then OCR confidence
+    return RULE_PRIORITY[result.rule], result.total, result.value, result.confidence
+
+def _stronger(candidate, best):
+    return best is None or _strength(candidate) > _strength(best)
+
+def extract_carbon_best(pdf_path, passes, accept_confidence):
+    """
+    OCRs at each DPI in `passes` (cheapest first) until a match reaches
+    `accept_confidence`; returns the strongest match seen, or None.
+    """
+    best = None
+    for dpi in passes:
+        result = extract_carbon_result(pdf_path, dpi)
+        if result and _stronger(result, best):
+            best = result
+        if best and best.confidence >= accept_confidence:
+            break
+    return best
+
 def extract_carbon_value(pdf_path):
     """
     Extracts numerical carbon values from a PDF by performing OCR.
     Ensures an integer is ALWAYS returned to avoid backend crashes.
     """
     try:
-        if not os.path.exists(pdf_path):
-            print(f"❌ File not found at {pdf_path}")
-            return 500  # Default fallback so the minting doesn't fail
+        result = extract_carbon_result(pdf_path)
+        if result:
+            return int(result.value)
 
-        print(f"🔍 OCR Engine: Processing {pdf_path}...")
-        
-        # 2. Convert PDF to images 
-        # Note: If this fails, ensure 'brew install poppler' is run
-        pages = convert_from_path(pdf_path)
-        full_text = ""
-        
-        for page in pages:
-            # 3. OpenCV Pre-processing
-            img = np.array(page)
-            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-            # Otsu's thresholding to handle shadows/lighting in scans
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            
-            # 4. Perform OCR
-            text = pytesseract.image_to_string(thresh)
-            full_text += text
-
-        # 5. DATA EXTRACTION LOGIC
-        # Pattern 1: Finds "500 tons", "250 tCO2e"
-        pattern_unit = r'(\d+(?:\.\d+)?)\s*(?:tons|tCO2e|tonnes|credits|CCT)'
-        # Pattern 2: Finds "Allowance: 500" or "Total: 1000"
-        pattern_key = r'(?:allowance|value|total|carbon|verified)\s*[:\-]?\s*(\d+(?:\.\d+)?)'
-
-        matches_unit = re.findall(pattern_unit, full_text, re.IGNORECASE)
-        matches_key = re.findall(pattern_key, full_text, re.IGNORECASE)
-        
-        all_matches = matches_unit + matches_key
-        
-        if all_matches:
-            # Convert to float, get the highest number, return as integer
-            val = max([float(x) for x in all_matches])
-            print(f"🎯 OCR Match Found: {val}")
-            return int(val)
-
-        # 6. Fallback (If document is unreadable or pattern doesn't match)
-        print("⚠️ No patterns matched. Returning 500 as a default for demo.")
+        # Fallback (If document is unreadable or pattern doesn't match)
+        log.warning("No patterns matched; returning the demo default", extra={"file": pdf_path, "value": 500})
         return 500
-        
+
     except Exception as e:
-        print(f"❌ OCR Critical Error: {e}")
+        log.error("OCR failed; returning the demo default", extra={"file": pdf_path, "error": str(e), "value": 500})
         # Always return a number so Phase 1 doesn't return 'None'
-        return 500
\ No newline at end of file
+        return 500
+
+# --- PAGE PIPELINE ---
+def _open_pgm(path):
+    """Opens a binary 8-bit PGM positioned at its pixels; returns (file, (rows, cols))"""
+    f = open(path, "rb")
+    tokens = []
+    while len(tokens) < 4:
+        line = f.readline()
+        if not line:
+            break
+        if not line.startswith(b"#"):
+            tokens.extend(line.split())
+    if len(tokens) < 4 or tokens[0] != b"P5" or tokens[3] != b"255":
+        f.close()
+        raise ValueError(f"Unsupported page raster: {path}")
+    return f, (int(tokens[2]), int(tokens[1]))
+
+def _read_pixels(f, buffer, path):
+    """readinto() until buffer is full; a truncated raster raises instead of leaving garbage"""
+    view = memoryview(buffer).cast("B")
+    try:
+        filled = 0
+        while filled < len(view):
+            count = f.readinto(view[filled:])
+            if not count:
+                raise ValueError(f"Truncated page raster: {path} ({filled} of {len(view)} bytes)")
+            filled += count
+    finally:
+        view.release()
+
+def _read_pgm(path):
+    """Reads the pixels straight into one array: the only copy of the page"""
+    f, shape = _open_pgm(path)
+    with f:
+        gray = np.empty(shape, dtype=np.uint8)
+        _read_pixels(f, gray, path)
+    return gray
+
+def _threshold_and_read(gray):
+    """Returns image_to_data's words with boxes and confidences, and when thresholding ended"""
+    # Otsu's thresholding to handle shadows/lighting in scans, in place
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    thresholded = time.perf_counter()
+    return pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT), thresholded
+
+def _ocr_page(gray):
+    started = time.perf_counter()
+    data, thresholded = _threshold_and_read(gray)
+    OCR_STAGE_SECONDS.labels("threshold").observe(thresholded - started)
+    OCR_STAGE_SECONDS.labels("tesseract").observe(time.perf_counter() - thresholded)
+    return data
+
+def _ocr_shared_page(name, shape):
+    """Runs in a worker process on a page living in shared memory; returns (words, threshold s, tesseract s)"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        gray = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        started = time.perf_counter()
+        data, thresholded = _threshold_and_read(gray)
+        del gray  # release the view before closing the segment
+        return data, thresholded - started, time.perf_counter() - thresholded
+    finally:
+        shm.close()
+
+_pool = None
+
+def _worker_ready(_):
+    # Importing this module in the worker loads OpenCV and pytesseract
+    return os.getpid()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: forking a threaded server process is unsafe
+        _pool = ProcessPoolExecutor(OCR_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _ocr_pages_in_pool(page_paths):
+    """Each page is read from disk directly into a shared memory segment; workers
+    attach to it by name, so no pixels are pickled between processes"""
+    pool = _get_pool()
+    segments, futures = [], []
+    try:
+        for path in page_paths:
+            f, shape = _open_pgm(path)
+            with f:
+                shm = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1])
+                segments.append(shm)
+                view = shm.buf[:shape[0] * shape[1]]
+                try:
+                    _read_pixels(f, view, path)
+                finally:
+                    view.release()
+            futures.append(pool.submit(_ocr_shared_page, shm.name, shape))
+
+        pages = []
+        for future in futures:
+            data, threshold_seconds, tesseract_seconds = future.result()
+            OCR_STAGE_SECONDS.labels("threshold").observe(threshold_seconds)
+            OCR_STAGE_SECONDS.labels("tesseract").observe(tesseract_seconds)
+            pages.append(data)
+        return pages
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+def _write_sample_pdf(path):
+    """A one-page PDF reading "Total: 42 tons", at OCR_DPI so it rasterizes pixel for pixel"""
+    from PIL import Image
+
+    page = np.full((120, 600), 255, dtype=np.uint8)
+    cv2.putText(page, "Total: 42 tons", (20, 75), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 0, 3)
+    Image.fromarray(page).save(path, "PDF", resolution=OCR_DPI)
+
+def warm_up():
+    """
+    Runs the whole pipeline (poppler, PGM read, threshold, tesseract) once on
+    a generated one-page PDF so the first real upload doesn't pay for loading
+    tesseract, its language data and OpenCV. Raises if the sample can't be
+    read, so /ready fails when OCR would; returns what was found otherwise.
+    """
+    if OCR_PROCESSES > 0:
+        # Start the workers now; spawning them costs an interpreter start each
+        list(_get_pool().map(_worker_ready, range(OCR_PROCESSES)))
+    with tempfile.TemporaryDirectory() as sample_dir:
+        sample_path = os.path.join(sample_dir, "warm_up.pdf")
+        _write_sample_pdf(sample_path)
+        match = extract_carbon_result(sample_path)
+    if match is None or match.value != 42:
+        raise RuntimeError(f"OCR sample read {match.text if match else 'nothing'!r}, expected 'Total: 42 tons'")
+    return {
+        "tesseract": str(pytesseract.get_tesseract_version()),
+        "poppler": shutil.which("pdftoppm") is not None,
+        "sample_read": True,
+        "sample_confidence": match.confidence,
+    }
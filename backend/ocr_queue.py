@@ -0,0 +1,144 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# Mongo-backed OCR task queue shared by the API (OCR_BACKEND=queue) and any
+# number of `python ocr_worker.py` processes on other machines.
+#   - The API enqueues a task pointing at the uploaded PDF and polls for it.
+#   - A worker claims the oldest available task with one atomic
+#     find_one_and_update, which also sets a lease (visibility timeout).
+#   - While OCR runs the worker heartbeats to extend its lease. If it crashes,
+#     the lease expires and another worker claims the task again, up to
+#     max_attempts; then the task is marked failed.
+# Task states: queued -> leased -> done | failed (leased -> queued on retry).
+
+OCR_TASK_VISIBILITY_TIMEOUT = float(os.getenv("OCR_TASK_VISIBILITY_TIMEOUT", "60"))
+OCR_TASK_MAX_ATTEMPTS = int(os.getenv("OCR_TASK_MAX_ATTEMPTS", "3"))
+# Finished tasks are purged after this long
+OCR_TASK_TTL_SECONDS = int(os.getenv("OCR_TASK_TTL_SECONDS", "86400"))
+
+
+class OcrTaskQueue:
+    def __init__(self, collection, visibility_timeout=OCR_TASK_VISIBILITY_TIMEOUT,
+                 max_attempts=OCR_TASK_MAX_ATTEMPTS):
+        self.collection = collection
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("state", 1), ("created_at", 1)])
+        await self.collection.create_index([("state", 1), ("lease_expires_at", 1)])
+        await self.collection.create_index("finished_at", expireAfterSeconds=OCR_TASK_TTL_SECONDS)
+
+    def _lease_until(self):
+        return datetime.utcnow() + timedelta(seconds=self.visibility_timeout)
+
+    # --- API SIDE ---
+    async def enqueue(self, file_path, passes, accept_confidence, request_id=None):
+        now = datetime.utcnow()
+        task_id = ObjectId()
+        await self.collection.insert_one({
+            "_id": task_id,
+            "file_path": file_path,
+            "passes": passes,
+            "accept_confidence": accept_confidence,
+            "request_id": request_id,
+            "state": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return task_id
+
+    async def wait(self, task_id, timeout, poll_interval=0.05, max_poll_interval=0.5):
+        """Polls until the task is done or failed; None on timeout"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            task = await self.collection.find_one(
+                {"_id": task_id, "state": {"$in": ["done", "failed"]}}
+            )
+            if task:
+                return task
+            if asyncio.get_running_loop().time() >= deadline:
+                return None
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, max_poll_interval)
+
+    async def cancel(self, task_id):
+        """Drops a task nobody has picked up yet (e.g. the caller timed out)"""
+        await self.collection.delete_one({"_id": task_id, "state": "queued"})
+
+    # --- WORKER SIDE ---
+    async def claim(self, worker_id):
+        """Leases the oldest queued task, or one whose previous worker stopped heartbeating"""
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"state": "queued"},
+                    {"state": "leased", "lease_expires_at": {"$lt": now}},
+                ],
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {"state": "leased", "lease_owner": worker_id, "leased_at": now,
+                         "lease_expires_at": self._lease_until(), "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def heartbeat(self, task_id, worker_id):
+        """Extends the lease; False if it was lost (expired and taken by another worker)"""
+        result = await self.collection.update_one(
+            {"_id": task_id, "state": "leased", "lease_owner": worker_id},
+            {"$set": {"lease_expires_at": self._lease_until(), "updated_at": datetime.utcnow()}}
+        )
+        return result.matched_count == 1
+
+    async def complete(self, task_id, worker_id, result):
+        now = datetime.utcnow()
+        done = await self.collection.update_one(
+            {"_id": task_id, "state": "leased", "lease_owner": worker_id},
+            {"$set": {"state": "done", "result": result, "finished_at": now, "updated_at": now}}
+        )
+        return done.matched_count == 1
+
+    async def fail(self, task_id, worker_id, error, error_kind, retry):
+        """Requeues the task while attempts remain (if retry), otherwise marks it failed"""
+        task = await self.collection.find_one({"_id": task_id}, {"attempts": 1})
+        now = datetime.utcnow()
+        if retry and task and task["attempts"] < self.max_attempts:
+            update = {"state": "queued", "error": error, "error_kind": error_kind, "updated_at": now}
+        else:
+            update = {"state": "failed", "error": error, "error_kind": error_kind,
+                      "finished_at": now, "updated_at": now}
+        await self.collection.update_one(
+            {"_id": task_id, "state": "leased", "lease_owner": worker_id},
+            {"$set": update, "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        )
+
+    async def reap(self):
+        """Fails tasks whose lease expired on their last attempt (their worker crashed every time)"""
+        now = datetime.utcnow()
+        result = await self.collection.update_many(
+            {"state": "leased", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"state": "failed", "error_kind": "lease_expired",
+                      "error": f"No worker finished the task in {self.max_attempts} attempts",
+                      "finished_at": now, "updated_at": now}}
+        )
+        return result.modified_count
+
+    async def stats(self):
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        async for row in self.collection.aggregate([{"$group": {"_id": "$state", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        oldest = await self.collection.find_one({"state": "queued"}, sort=[("created_at", 1)])
+        counts["oldest_queued_seconds"] = (
+            round((datetime.utcnow() - oldest["created_at"]).total_seconds(), 1) if oldest else 0
+        )
+        return counts
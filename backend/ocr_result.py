@@ -0,0 +1,19 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# What OCR read from a document. Kept apart from ocr_engine so the API can
+# rebuild results coming back from OCR workers without importing OpenCV,
+# numpy and tesseract.
+
+
+@dataclass
+class ExtractionResult:
+    value: float
+    unit: Optional[str]
+    page: int                          # 1-based
+    bbox: Tuple[int, int, int, int]    # left, top, width, height in page pixels at `dpi`
+    confidence: float                  # Tesseract word confidence, 0-100 (lowest word of the match)
+    rule: str                          # key_unit | key | unit
+    text: str                          # the OCR line the value came from
+    dpi: int
+    total: bool = False                # the line names a total
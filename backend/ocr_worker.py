@@ -0,0 +1,135 @@
+import os
+import socket
+import signal
+import asyncio
+from dataclasses import asdict
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import logs
+import ocr_engine
+from ocr_queue import OcrTaskQueue
+
+# Standalone OCR worker for OCR_BACKEND=queue (see ocr_queue.py).
+#   cd backend && python ocr_worker.py
+# Run as many as needed, on any machine that can reach Mongo and the shared
+# upload store; each one claims tasks independently, so throughput grows with
+# the number of workers. SIGTERM/SIGINT finish in-flight tasks and exit.
+
+load_dotenv()
+
+MONGO_DETAILS = os.getenv("MONGO_DETAILS")
+# Tasks OCR'd at once by this worker
+OCR_WORKER_CONCURRENCY = int(os.getenv("OCR_WORKER_CONCURRENCY", str(os.cpu_count() or 1)))
+# Where the API's upload paths are resolved (the API stores "uploads/<file>")
+OCR_SHARED_ROOT = os.getenv("OCR_SHARED_ROOT", ".")
+OCR_WORKER_POLL_INTERVAL = float(os.getenv("OCR_WORKER_POLL_INTERVAL", "0.5"))
+WORKER_ID = os.getenv("OCR_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+log = logs.get_logger("ocr_worker")
+
+
+class OcrWorker:
+    def __init__(self, queue, worker_id=WORKER_ID, concurrency=OCR_WORKER_CONCURRENCY,
+                 shared_root=OCR_SHARED_ROOT, poll_interval=OCR_WORKER_POLL_INTERVAL):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.shared_root = shared_root
+        self.poll_interval = poll_interval
+        self._stopping = asyncio.Event()
+
+        # Metrics
+        self.completed = 0
+        self.failed = 0
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        log.info("OCR worker running", extra={"worker_id": self.worker_id, "slots": self.concurrency})
+        await asyncio.gather(*(self._slot() for _ in range(self.concurrency)))
+        log.info("OCR worker stopped", extra={"worker_id": self.worker_id,
+                                              "completed": self.completed, "failed": self.failed})
+
+    async def _slot(self):
+        while not self._stopping.is_set():
+            try:
+                await self.queue.reap()
+                task = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                log.warning("Queue unavailable", extra={"error": str(e)})
+                task = None
+            if task is None:
+                # Idle: wait for the next poll, or wake up at once on shutdown
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(task)
+            except Exception as e:
+                # Couldn't record the outcome; the lease expires and the task is retried
+                log.error("OCR task not recorded", extra={"task_id": task["_id"], "error": str(e)})
+
+    async def _heartbeat(self, task_id):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not await self.queue.heartbeat(task_id, self.worker_id):
+                log.warning("Lost lease on OCR task", extra={"task_id": task_id})
+                return
+
+    async def _process(self, task):
+        task_id = task["_id"]
+        path = os.path.join(self.shared_root, task["file_path"])
+        # Worker logs carry the request ID of the upload that queued the task
+        token = logs.request_id_var.set(task.get("request_id"))
+        heartbeat = asyncio.create_task(self._heartbeat(task_id))
+        try:
+            match = await asyncio.to_thread(
+                ocr_engine.extract_carbon_best, path, task["passes"], task["accept_confidence"]
+            )
+        except (*ocr_engine.ENGINE_ERRORS, FileNotFoundError) as e:
+            # This host's fault (missing binaries, upload not synced yet): let another worker try
+            self.failed += 1
+            error_kind = "not_found" if isinstance(e, FileNotFoundError) else "engine"
+            log.warning("OCR task failed on this worker", extra={"task_id": task_id, "attempt": task["attempts"],
+                                                              "error_kind": error_kind, "error": str(e)})
+            await self.queue.fail(task_id, self.worker_id, str(e), error_kind, retry=True)
+            return
+        except Exception as e:
+            # The document itself can't be read; retrying won't help
+            self.failed += 1
+            log.warning("OCR task failed", extra={"task_id": task_id, "error_kind": "unreadable", "error": str(e)})
+            await self.queue.fail(task_id, self.worker_id, str(e), "unreadable", retry=False)
+            return
+        finally:
+            heartbeat.cancel()
+            logs.request_id_var.reset(token)
+
+        result = asdict(match) if match else None
+        if await self.queue.complete(task_id, self.worker_id, result):
+            self.completed += 1
+
+
+async def main():
+    logs.configure()
+    client = AsyncIOMotorClient(MONGO_DETAILS)
+    queue = OcrTaskQueue(client.carbon_cred_db.get_collection("ocr_tasks"))
+    await queue.ensure_indexes()
+    log.info("OCR warmed up", extra={"detail": await asyncio.to_thread(ocr_engine.warm_up)})
+
+    worker = OcrWorker(queue)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
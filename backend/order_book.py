@@ -0,0 +1,205 @@
+import heapq
+import random
+
+# In-memory order book of open marketplace listings (active and not yet paid).
+# Listings are kept in two balanced search trees (treaps) so updates and
+# best-price queries are logarithmic instead of a full scan of marketListings
+# plus a client-side sort:
+#   _by_price:  (price_per_token, listing_id), with the total amount per subtree
+#               -> cheapest n, and the cheapest whole-listing fill by descent
+#   _by_amount: (amount, price_per_token, listing_id), with the cheapest
+#               (price, id) per subtree -> cheapest listings above an amount
+# Listings are all-or-nothing on-chain (releaseTokens moves the whole amount),
+# so a "fill" is a set of whole listings.
+
+
+class _Node:
+    __slots__ = ("key", "listing_id", "amount", "best", "priority", "left", "right",
+                 "size", "total", "min_best")
+
+    def __init__(self, key, listing_id, amount, best):
+        self.key = key
+        self.listing_id = listing_id
+        self.amount = amount
+        self.best = best  # (price, listing_id)
+        self.priority = random.random()
+        self.left = self.right = None
+        _pull(self)
+
+
+def _pull(node):
+    """Recomputes a node's subtree aggregates from its children"""
+    node.size, node.total, node.min_best = 1, node.amount, node.best
+    for child in (node.left, node.right):
+        if child is not None:
+            node.size += child.size
+            node.total += child.total
+            if child.min_best < node.min_best:
+                node.min_best = child.min_best
+    return node
+
+
+def _split(node, key, inclusive=False):
+    """(keys < key, keys >= key); with inclusive, (keys <= key, keys > key)"""
+    if node is None:
+        return None, None
+    if node.key < key or (inclusive and node.key == key):
+        left, right = _split(node.right, key, inclusive)
+        node.right = left
+        return _pull(node), right
+    left, right = _split(node.left, key, inclusive)
+    node.left = right
+    return left, _pull(node)
+
+
+def _merge(left, right):
+    """Joins two treaps where every key in left is below every key in right"""
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _pull(left)
+    right.left = _merge(left, right.left)
+    return _pull(right)
+
+
+class _SortedIndex:
+    """Treap keyed by tuples: O(log n) insert and remove, ordered iteration"""
+
+    def __init__(self):
+        self.root = None
+
+    def insert(self, key, listing_id, amount, best):
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key, listing_id, amount, best)), right)
+
+    def remove(self, key):
+        left, rest = _split(self.root, key)
+        _, right = _split(rest, key, inclusive=True)
+        self.root = _merge(left, right)
+
+    def first(self, n):
+        """listing_ids of the n smallest keys"""
+        out, stack, node = [], [], self.root
+        while (stack or node) and len(out) < n:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            out.append(node.listing_id)
+            node = node.right
+        return out
+
+    def prefix_covering(self, amount):
+        """Smallest k whose first k amounts sum to >= amount (all of them if none do), and that sum"""
+        node, count, total = self.root, 0, 0
+        while node is not None:
+            left_size = node.left.size if node.left else 0
+            left_total = node.left.total if node.left else 0
+            if total + left_total >= amount:
+                node = node.left
+            elif total + left_total + node.amount >= amount:
+                return count + left_size + 1, total + left_total + node.amount
+            else:
+                count += left_size + 1
+                total += left_total + node.amount
+                node = node.right
+        return count, total
+
+    def cheapest_from(self, key, n):
+        """listing_ids of the n lowest `best` among keys >= key"""
+        # The keys >= key are O(log n) single nodes and whole subtrees along the
+        # search path; expand them cheapest-first with a heap on min_best
+        heap = []
+        node = self.root
+        while node is not None:
+            if node.key >= key:
+                heapq.heappush(heap, (node.best, 0, node))
+                if node.right is not None:
+                    heapq.heappush(heap, (node.right.min_best, 1, node.right))
+                node = node.left
+            else:
+                node = node.right
+
+        out = []
+        while heap and len(out) < n:
+            _, is_subtree, node = heapq.heappop(heap)
+            if not is_subtree:
+                out.append(node.listing_id)
+                continue
+            heapq.heappush(heap, (node.best, 0, node))
+            for child in (node.left, node.right):
+                if child is not None:
+                    heapq.heappush(heap, (child.min_best, 1, child))
+        return out
+
+
+class OrderBook:
+    def __init__(self):
+        self._listings = {}
+        self._by_price = _SortedIndex()
+        self._by_amount = _SortedIndex()
+
+    def __len__(self):
+        return len(self._listings)
+
+    def __contains__(self, listing_id):
+        return listing_id in self._listings
+
+    # --- UPDATES ---
+    def add(self, listing_id, seller_wallet, amount, price_per_token, qr_url="", seller_company="Unknown"):
+        if listing_id in self._listings:
+            self.remove(listing_id)
+        self._listings[listing_id] = {
+            "listing_id": listing_id,
+            "seller_company": seller_company,
+            "seller_wallet": seller_wallet,
+            "amount": amount,
+            "price_per_token": price_per_token,
+            "qr_url": qr_url,
+        }
+        best = (price_per_token, listing_id)
+        self._by_price.insert(best, listing_id, amount, best)
+        self._by_amount.insert((amount, price_per_token, listing_id), listing_id, amount, best)
+
+    def remove(self, listing_id):
+        listing = self._listings.pop(listing_id, None)
+        if listing is None:
+            return None
+        price, amount = listing["price_per_token"], listing["amount"]
+        self._by_price.remove((price, listing_id))
+        self._by_amount.remove((amount, price, listing_id))
+        return listing
+
+    def clear(self):
+        self.__init__()
+
+    # --- QUERIES ---
+    def get(self, listing_id):
+        return self._listings.get(listing_id)
+
+    def ids(self):
+        return list(self._listings)
+
+    def cheapest(self, n=10):
+        """The n lowest-priced listings"""
+        return [self._listings[listing_id] for listing_id in self._by_price.first(n)]
+
+    def covering(self, min_amount, n=10):
+        """The n cheapest listings that each hold at least min_amount tokens"""
+        return [self._listings[listing_id] for listing_id in self._by_amount.cheapest_from((min_amount,), n)]
+
+    def cheapest_fill(self, required_amount):
+        """Cheapest set of whole listings (in price order) covering required_amount"""
+        if required_amount <= 0:
+            return {"required_amount": required_amount, "filled_amount": 0, "shortfall": 0,
+                    "total_cost": 0, "listings": []}
+        count, filled = self._by_price.prefix_covering(required_amount)
+        listings = self.cheapest(count)
+        return {
+            "required_amount": required_amount,
+            "filled_amount": filled,
+            "shortfall": max(0, required_amount - filled),
+            "total_cost": sum(l["amount"] * l["price_per_token"] for l in listings),
+            "listings": listings,
+        }
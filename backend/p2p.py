@@ -33,23 +33,16 @@ async def run_perfect_p2p():
     listing_id = l_data.get("listing_id")
     print(f"✅ Listed! ID: {listing_id} | TX: {l_data['tx_hash'][:15]}...")
 
-    # 2. TWITCH MARKS AS PAID
-    print(f"\n💸 STEP 2: Twitch marking Listing #{listing_id} as PAID...")
-    paid_res = requests.post(f"{BASE_URL}/marketplace/mark-paid/{listing_id}", params={"buyer_company": "TWITCH"})
-    if paid_res.json().get("status") != "MARKED_PAID":
-        print(f"❌ Mark Paid Failed: {paid_res.json()}"); return
-    print("✅ Twitch signaled payment.")
-
-    # 3. TESLA RELEASES & DB UPDATES
-    print("\n🔓 STEP 3: Tesla releasing tokens and updating Database...")
-    rel_res = requests.post(f"{BASE_URL}/marketplace/release/{listing_id}", params={"buyer_wallet": TWITCH_WALLET})
-    r_data = rel_res.json()
-    if r_data.get("status") != "RELEASED":
-        print(f"❌ Release Failed: {r_data}"); return
-    print(f"✅ Released! TX: {r_data['tx_hash'][:15]}...")
-
-    # 4. FINAL DB & BLOCKCHAIN VERIFICATION
-    print("\n🔍 STEP 4: Final Verification (Blockchain vs DB)...")
+    # 2. TWITCH PAYS AND TESLA RELEASES (single trade call)
+    print(f"\n💸 STEP 2: Twitch buying Listing #{listing_id} (mark paid + release)...")
+    trade_res = requests.post(f"{BASE_URL}/marketplace/execute-trade/{listing_id}", params={"buyer_company": "TWITCH"})
+    t_data = trade_res.json()
+    if t_data.get("status") != "TRADED":
+        print(f"❌ Trade Failed: {t_data}"); return
+    print(f"✅ Traded! TX: {t_data['tx_hash'][:15]}... | Same block: {t_data.get('same_block')}")
+
+    # 3. FINAL DB & BLOCKCHAIN VERIFICATION
+    print("\n🔍 STEP 3: Final Verification (Blockchain vs DB)...")
     
     # Check DB
     twitch_db = await companies_col.find_one({"name": "TWITCH"})
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import inspect
+import threading
+from datetime import datetime
+
+# Opt-in sampling profiler for live requests.
+# A request is profiled when it carries "X-Profile: 1" plus a valid
+# "X-Admin-Token", or when it wins the PROFILE_SAMPLE_RATE coin flip. A
+# background thread then samples stacks every PROFILE_INTERVAL seconds:
+#   - running threads (the event loop, OCR and other worker threads) give
+#     CPU-bound stacks;
+#   - threads blocked reading a socket (RPC calls, pymongo in Motor's
+#     executor) count toward wall time only, never CPU;
+#   - when the event loop is idle, the request's coroutine chain gives the
+#     await it is suspended in (Mongo, receipt waits, ...), so the wall-clock
+#     profile also covers I/O. The asyncio loop idles in select(); uvloop
+#     idles in C, leaving the frame that started the loop (e.g. runners.py
+#     run) on top, which the profiler finds from the request's own stack.
+# Profiles are saved as speedscope JSON with a "wall" and a "cpu" profile and
+# can be downloaded from /admin/profiles. Untriggered requests pay one header
+# lookup.
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# (file suffix, function) pairs where a thread is parked, not working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+# Pure-Python frames right above a blocking socket call: waiting on I/O, not using CPU
+IO_FRAMES = {
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("socket.py", "create_connection"),
+    ("connection.py", "create_connection"),  # urllib3
+    ("ssl.py", "read"),
+    ("ssl.py", "recv"),
+    ("ssl.py", "recv_into"),
+    ("ssl.py", "do_handshake"),
+    ("network_layer.py", "receive_data"),    # pymongo
+}
+
+
+def _matches(frame, frames):
+    code = frame.f_code
+    return any(code.co_filename.endswith(f) and code.co_name == n for f, n in frames)
+
+
+def _is_idle(frame):
+    return _matches(frame, IDLE_FRAMES)
+
+
+def _loop_entry_code():
+    """
+    Code of the frame that drives the running loop: the caller of the
+    outermost coroutine frame on this thread's stack. Under uvloop it is the
+    loop thread's top frame whenever the loop waits for events.
+    """
+    entry, frame = None, sys._getframe()
+    while frame is not None:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE and frame.f_back is not None:
+            entry = frame.f_back.f_code
+        frame = frame.f_back
+    return entry
+
+
+def _frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(task):
+    """Where a suspended task is waiting: its coroutine chain, outermost first"""
+    stack = []
+    coro = task.get_coro() if task else None
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    if stack:
+        stack.append(("<awaiting I/O>", "", 0))
+    return stack
+
+
+class SamplingProfiler:
+    def __init__(self, loop_thread_id, task, interval=PROFILE_INTERVAL, loop_entry=None):
+        self.loop_thread_id = loop_thread_id
+        self.task = task
+        self.loop_entry = loop_entry  # see _loop_entry_code()
+        self.interval = interval
+        self.samples = []  # (stack, wall seconds, cpu seconds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return time.perf_counter() - self._started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last_wall, last_cpu = time.perf_counter(), time.process_time()
+        while not self._stop.wait(self.interval):
+            now_wall, now_cpu = time.perf_counter(), time.process_time()
+            wall, cpu = now_wall - last_wall, now_cpu - last_cpu
+            last_wall, last_cpu = now_wall, now_cpu
+
+            busy = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                loop_idle = thread_id == self.loop_thread_id and frame.f_code is self.loop_entry
+                if _matches(frame, IO_FRAMES):
+                    self.samples.append((_frame_stack(frame), wall, 0.0))
+                elif not (loop_idle or _is_idle(frame)):
+                    busy.append(_frame_stack(frame))
+                elif thread_id == self.loop_thread_id:
+                    # Loop parked (select() or uvloop): attribute the time to our await point
+                    try:
+                        stack = _await_stack(self.task)
+                    except Exception:
+                        stack = []
+                    if stack:
+                        self.samples.append((stack, wall, 0.0))
+
+            # Process CPU time since the last tick is shared by the threads that were running
+            for stack in busy:
+                self.samples.append((stack, wall, cpu / len(busy)))
+
+
+def to_speedscope(name, samples, duration):
+    frames, index = [], {}
+    wall_stacks, wall_weights, cpu_stacks, cpu_weights = [], [], [], []
+    for stack, wall, cpu in samples:
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            ids.append(index[frame])
+        wall_stacks.append(ids)
+        wall_weights.append(wall)
+        if cpu > 0:
+            cpu_stacks.append(ids)
+            cpu_weights.append(cpu)
+
+    def profile(kind, stacks, weights):
+        return {"type": "sampled", "name": f"{name} ({kind})", "unit": "seconds",
+                "startValue": 0, "endValue": sum(weights) if kind == "cpu" else duration,
+                "samples": stacks, "weights": weights}
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "carbon-marketplace profiler",
+        "shared": {"frames": frames},
+        "profiles": [profile("wall", wall_stacks, wall_weights), profile("cpu", cpu_stacks, cpu_weights)],
+    }
+
+
+def to_folded(speedscope, kind="wall"):
+    """Brendan Gregg folded stacks ("a;b;c weight") for flamegraph.pl / inferno"""
+    frames = speedscope["shared"]["frames"]
+    profile = next(p for p in speedscope["profiles"] if p["name"].endswith(f"({kind})"))
+    totals = {}
+    for stack, weight in zip(profile["samples"], profile["weights"]):
+        key = ";".join(frames[i]["name"] for i in stack)
+        totals[key] = totals.get(key, 0) + weight
+    # Integer weights in microseconds
+    return "\n".join(f"{key} {int(weight * 1e6)}" for key, weight in totals.items()) + "\n"
+
+
+class ProfileStore:
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.speedscope.json")
+
+    def save(self, profile_id, speedscope):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(profile_id), "w") as f:
+            json.dump(speedscope, f)
+        for stale in self.list()[self.keep:]:
+            os.remove(self._path(stale["profile_id"]))
+
+    def load(self, profile_id):
+        path = self._path(os.path.basename(profile_id))
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".speedscope.json"):
+                path = os.path.join(self.directory, name)
+                entries.append({
+                    "profile_id": name[:-len(".speedscope.json")],
+                    "created_at": datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat(),
+                    "size_bytes": os.path.getsize(path),
+                })
+        return sorted(entries, key=lambda e: e["created_at"], reverse=True)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware; adds X-Profile-Id to profiled responses"""
+
+    def __init__(self, app, store=None, sample_rate=PROFILE_SAMPLE_RATE, admin_token=ADMIN_TOKEN):
+        self.app = app
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self._active = False  # one profile at a time keeps samples attributable
+
+    def _requested(self, scope):
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            token = headers.get(b"x-admin-token", b"").decode()
+            return bool(self.admin_token) and token == self.admin_token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        self._active = True
+        profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = SamplingProfiler(threading.get_ident(), asyncio.current_task(), loop_entry=_loop_entry_code())
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # Joining the sampler blocks for up to one interval; not on the loop
+            duration = await asyncio.to_thread(profiler.stop)
+            self._active = False
+            name = f"{scope['method']} {scope['path']}"
+            speedscope = to_speedscope(name, profiler.samples, duration)
+            await asyncio.to_thread(self.store.save, profile_id, speedscope)
@@ -0,0 +1,150 @@
+import os
+import asyncio
+import threading
+from contextlib import nullcontext
+from collections import OrderedDict
+
+from web3.exceptions import ContractLogicError
+
+import logs
+
+# Read-through cache for contract view calls (nextListingId, marketListings,
+# balanceOf, ...). Contract state only changes with a new block, so results
+# are keyed by (function, args, block) and reads are pinned to that block:
+#   - a background watcher polls the block number; a newer block drops every
+#     entry at once;
+#   - receipts of our own writes are fed in with observe_block(), so a read
+#     after a write already sees the block that contains it;
+#   - call(..., fresh=True) skips the cache entirely (reads "latest").
+#   - if a pinned read fails (e.g. a lagging replica without that block), it is
+#     retried pinned on the primary; it never falls back to "latest", which
+#     could be older than the block we're pinned to.
+# Repeated reads inside one block are answered from memory.
+# on_new_block(callback) lets other in-memory state (the order book) re-sync:
+# the watcher awaits callback(block) once for each block it sees advance.
+
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "10000"))
+BLOCK_POLL_INTERVAL = float(os.getenv("BLOCK_POLL_INTERVAL", "1"))
+
+log = logs.get_logger("read_cache")
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, str) and value.startswith("0x"):
+        return value.lower()  # checksummed and lowercase addresses share an entry
+    return value
+
+
+class ContractReadCache:
+    def __init__(self, w3, max_entries=READ_CACHE_MAX_ENTRIES, poll_interval=BLOCK_POLL_INTERVAL):
+        self.w3 = w3
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self._entries = OrderedDict()  # (address, fn_name, args, block) -> result, LRU order
+        self._block = None
+        self._lock = threading.Lock()
+        self._task = None
+        self._listeners = []
+        self._notified_block = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def block(self):
+        return self._block
+
+    def observe_block(self, number):
+        """A block newer than the cached one invalidates every entry"""
+        with self._lock:
+            if self._block is None or number > self._block:
+                self._block = number
+                self._entries.clear()
+                self.invalidations += 1
+
+    def call(self, contract_fn, fresh=False):
+        """contract_fn.call(), served from memory when already read in the current block"""
+        block = self._block
+        if fresh or block is None:
+            return contract_fn.call()
+
+        key = (contract_fn.address, contract_fn.fn_name, _hashable(contract_fn.args), block)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        try:
+            result = contract_fn.call(block_identifier=block)
+        except ContractLogicError:
+            raise  # a revert at this block is the answer
+        except Exception as e:
+            log.warning("Pinned read failed, retrying on the primary",
+                        extra={"function": contract_fn.fn_name, "block": block, "error": str(e)})
+            with self._primary_reads():
+                result = contract_fn.call(block_identifier=block)
+        with self._lock:
+            # Skip the store if a newer block arrived while we were reading
+            if self._block == block:
+                self._entries[key] = result
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def on_new_block(self, callback):
+        """callback(block) coroutine, awaited by the watcher after the block advances"""
+        self._listeners.append(callback)
+
+    async def _notify(self):
+        block = self._block
+        if block is None or block == self._notified_block:
+            return
+        self._notified_block = block
+        for callback in self._listeners:
+            try:
+                await callback(block)
+            except Exception as e:
+                log.warning("New-block listener failed", extra={"block": block, "error": str(e)})
+
+    def _primary_reads(self):
+        primary_reads = getattr(self.w3.provider, "primary_reads", None)
+        return primary_reads() if primary_reads else nullcontext()
+
+    async def start(self):
+        """Starts the watcher, then reads the current block; the watcher runs even if that read raises"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self.observe_block(await asyncio.to_thread(lambda: self.w3.eth.block_number))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.observe_block(await asyncio.to_thread(lambda: self.w3.eth.block_number))
+            except Exception as e:
+                log.warning("Block watcher failed", extra={"error": str(e)})
+            # Also covers blocks observed from our own receipts since the last poll
+            await self._notify()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "block": self._block,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,434 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from eth_utils import function_abi_to_4byte_selector
+from web3 import Web3
+from web3.middleware import Web3Middleware
+from web3.providers.base import JSONBaseProvider
+
+from metrics import RPC_REQUEST_SECONDS, RPC_ERRORS
+
+# Multi-endpoint JSON-RPC provider.
+#   - Every endpoint keeps a keep-alive connection pool.
+#   - Writes (and nonce/receipt lookups, which must see our own pending
+#     transactions) go to the primary: the first URL.
+#   - Reads go to the healthy endpoint with the lowest latency (EWMA), failing
+#     over to the next one on transport errors and on JSON-RPC errors other
+#     than reverts (e.g. a replica that doesn't have the requested block yet).
+#   - Read-your-writes: for RPC_PIN_AFTER_WRITE seconds after a transaction is
+#     sent, reads go to the primary; after that, "latest" reads only go to
+#     endpoints whose head has reached the newest block holding one of our
+#     receipts. A read pinned to block N prefers endpoints that reached N.
+#     Replica heads are learned from the responses they serve.
+#   - primary_reads() forces the calling thread's reads onto the primary.
+#   - Concurrent identical reads (eth_call etc.) share one request.
+#   - Reads that queue up while other reads are in flight go out together as
+#     JSON-RPC batches (group commit); up to RPC_MAX_INFLIGHT_BATCHES batches
+#     are in flight at once, so one slow batch doesn't hold up every reader.
+# All endpoints must serve the same chain.
+
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+# Extra time the batch leader waits for company; 0 = only batch what is already queued
+RPC_BATCH_WINDOW = float(os.getenv("RPC_BATCH_WINDOW", "0"))
+RPC_MAX_BATCH = int(os.getenv("RPC_MAX_BATCH", "100"))
+RPC_UNHEALTHY_COOLDOWN = float(os.getenv("RPC_UNHEALTHY_COOLDOWN", "10"))
+RPC_MAX_INFLIGHT_BATCHES = int(os.getenv("RPC_MAX_INFLIGHT_BATCHES", "4"))
+RPC_PIN_AFTER_WRITE = float(os.getenv("RPC_PIN_AFTER_WRITE", "5"))
+
+PRIMARY_METHODS = {
+    "eth_sendRawTransaction",
+    "eth_sendTransaction",
+    "eth_getTransactionCount",
+    "eth_getTransactionReceipt",
+    "eth_getTransactionByHash",
+}
+COALESCE_METHODS = {
+    "eth_call",
+    "eth_blockNumber",
+    "eth_chainId",
+    "eth_gasPrice",
+    "eth_feeHistory",
+    "eth_getBalance",
+    "eth_getCode",
+    "eth_getBlockByNumber",
+}
+# Position of the block parameter, for reads that take one
+BLOCK_PARAM = {
+    "eth_call": 1,
+    "eth_estimateGas": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getStorageAt": 2,
+    "eth_getTransactionCount": 1,
+    "eth_getBlockByNumber": 0,
+}
+
+
+def _block_param(method, params):
+    """The block number a read is pinned to, or None for latest/pending/default"""
+    index = BLOCK_PARAM.get(method)
+    if index is None or not params or len(params) <= index:
+        return None
+    block = params[index]
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith("0x"):
+        return int(block, 16)
+    return None
+
+
+def _retryable(response):
+    """Missing answers and node errors fail over; reverts are the same everywhere"""
+    if not isinstance(response, dict) or ("result" not in response and "error" not in response):
+        return True
+    error = response.get("error")
+    if not error:
+        return False
+    message = str(error.get("message", "")) if isinstance(error, dict) else str(error)
+    code = error.get("code") if isinstance(error, dict) else None
+    return code != 3 and "revert" not in message.lower()
+
+
+def rpc_urls():
+    """RPC_URLS (comma-separated) wins over the single RPC_URL"""
+    urls = os.getenv("RPC_URLS") or os.getenv("RPC_URL", "http://127.0.0.1:8545")
+    return [url.strip() for url in urls.split(",") if url.strip()]
+
+
+def make_web3(urls=None):
+    return Web3(MultiEndpointProvider(urls or rpc_urls()))
+
+
+class RpcMetricsMiddleware(Web3Middleware):
+    """Times every RPC by method; eth_call is labelled with the contract function"""
+    selectors = {}  # "0x70a08231" -> "balanceOf"
+
+    @classmethod
+    def register_abi(cls, abi):
+        for entry in abi:
+            if entry.get("type") == "function":
+                selector = "0x" + function_abi_to_4byte_selector(entry).hex()
+                cls.selectors[selector] = entry["name"]
+
+    def _label(self, method, params):
+        if method in ("eth_call", "eth_estimateGas") and params and isinstance(params[0], dict):
+            data = params[0].get("data") or params[0].get("input") or ""
+            if not isinstance(data, str):
+                data = "0x" + bytes(data).hex()
+            return f"{method}:{self.selectors.get(data[:10], 'unknown')}"
+        return method
+
+    def wrap_make_request(self, make_request):
+        def middleware(method, params):
+            label = self._label(method, params)
+            started = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                RPC_ERRORS.labels(label).inc()
+                raise
+            finally:
+                RPC_REQUEST_SECONDS.labels(label).observe(time.perf_counter() - started)
+            if isinstance(response, dict) and "error" in response:
+                RPC_ERRORS.labels(label).inc()
+            return response
+        return middleware
+
+
+class Endpoint:
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latency = None  # EWMA seconds; None = not measured yet
+        self.head = None     # highest block this endpoint is known to have
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def post(self, payload, timeout):
+        started = time.perf_counter()
+        self.requests += 1
+        try:
+            response = self.session.post(
+                self.url, data=payload, timeout=timeout,
+                headers={"Content-Type": "application/json"}
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            self.errors += 1
+            self.down_until = time.monotonic() + RPC_UNHEALTHY_COOLDOWN
+            raise
+        elapsed = time.perf_counter() - started
+        self.latency = elapsed if self.latency is None else (
+            self.EWMA_ALPHA * elapsed + (1 - self.EWMA_ALPHA) * self.latency
+        )
+        return response.content
+
+    def saw_block(self, number):
+        if self.head is None or number > self.head:
+            self.head = number
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "head": self.head,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class _Call:
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.block = _block_param(method, params)
+        self.done = threading.Event()   # response or error is set
+        self.wake = threading.Event()   # done, or promoted to batch leader
+        self.waiting = False            # a non-leader thread is blocked on wake
+        self.promoted = False
+        self.response = None
+        self.error = None
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class MultiEndpointProvider(JSONBaseProvider):
+    def __init__(self, urls, pool_size=RPC_POOL_SIZE, timeout=RPC_TIMEOUT,
+                 batch_window=RPC_BATCH_WINDOW, max_batch=RPC_MAX_BATCH,
+                 max_inflight_batches=RPC_MAX_INFLIGHT_BATCHES, pin_after_write=RPC_PIN_AFTER_WRITE,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if not urls:
+            raise ValueError("MultiEndpointProvider needs at least one RPC URL")
+        self.endpoints = [Endpoint(url, pool_size) for url in urls]
+        self.primary = self.endpoints[0]
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_inflight_batches = max_inflight_batches
+        self.pin_after_write = pin_after_write
+
+        self._lock = threading.Lock()
+        self._inflight = {}  # coalescing key -> _Call
+        self._queue = []     # reads waiting for the next batch
+        self._senders = 0    # batch leaders currently sending
+        self._next_id = 0
+        self._local = threading.local()
+
+        # Read-your-writes state
+        self._pinned_until = 0.0
+        self._write_block = None  # newest block holding one of our receipts
+
+    def __str__(self):
+        return f"RPC connection {', '.join(e.url for e in self.endpoints)}"
+
+    # --- ENTRY POINT ---
+    def make_request(self, method, params):
+        if method in PRIMARY_METHODS or getattr(self._local, "primary_only", False):
+            return self._send([_Call(method, params)], [self.primary])[0]
+        if method in COALESCE_METHODS:
+            return self._coalesced(method, params)
+        return self._batched(method, params)
+
+    # --- COALESCING ---
+    def _coalesced(self, method, params):
+        key = (method, json.dumps(params, sort_keys=True, default=str))
+        with self._lock:
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._inflight[key] = _Call(method, params)
+        if not leader:
+            shared.done.wait()
+            return shared.result()
+        try:
+            shared.response = self._batched(method, params)
+        except Exception as e:
+            shared.error = e
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            shared.done.set()
+        return shared.result()
+
+    @contextmanager
+    def primary_reads(self):
+        """with provider.primary_reads(): every RPC from this thread goes to the primary"""
+        previous = getattr(self._local, "primary_only", False)
+        self._local.primary_only = True
+        try:
+            yield
+        finally:
+            self._local.primary_only = previous
+
+    # --- GROUP-COMMIT BATCHING ---
+    def _batched(self, method, params):
+        call = _Call(method, params)
+        with self._lock:
+            self._queue.append(call)
+            leader = self._senders < self.max_inflight_batches
+            if leader:
+                self._senders += 1
+            call.waiting = not leader
+        if not leader:
+            call.wake.wait()
+            if not call.promoted:
+                return call.result()
+            # Promoted: this thread now holds a sender slot, even if another
+            # leader already sent its call in the meantime
+
+        # This thread sends what is queued (usually including its own call)
+        if self.batch_window:
+            time.sleep(self.batch_window)
+        with self._lock:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+        if batch:
+            self._dispatch(batch)
+        with self._lock:
+            # Hand the slot to the oldest waiter instead of draining for it. Calls
+            # of leaders still in their batch window are not waiting: their own
+            # leader sends them, so the slot is released instead.
+            waiter = next((queued for queued in self._queue if queued.waiting), None)
+            if waiter:
+                waiter.waiting = False
+                waiter.promoted = True
+                waiter.wake.set()
+            else:
+                self._senders -= 1
+        call.done.wait()
+        return call.result()
+
+    def _dispatch(self, batch):
+        try:
+            responses = self._send(batch, self._read_order(batch))
+            for call, response in zip(batch, responses):
+                call.response = response
+        except Exception as e:
+            for call in batch:
+                call.error = e
+        for call in batch:
+            call.done.set()
+            call.wake.set()
+
+    # --- ROUTING ---
+    def _read_order(self, calls):
+        """Endpoints that can answer every call consistently, fastest healthy first"""
+        def rank(endpoint):
+            return (not endpoint.healthy, endpoint.latency or 0.0)
+        ranked = sorted(self.endpoints, key=rank)
+
+        if time.monotonic() < self._pinned_until:
+            # Our transaction may not be mined yet: only the primary has it pending
+            return [self.primary] + [e for e in ranked if e is not self.primary and any(c.block for c in calls)]
+
+        pinned = [call.block for call in calls if call.block is not None]
+        needed = max(pinned + ([self._write_block] if len(pinned) < len(calls) and self._write_block else []),
+                     default=None)
+        if needed is None:
+            return ranked
+
+        def caught_up(endpoint):
+            return endpoint is self.primary or (endpoint.head is not None and endpoint.head >= needed)
+        ready = [e for e in ranked if caught_up(e)]
+        if len(pinned) == len(calls):
+            # A block-pinned answer is right wherever it comes from; lagging endpoints just error
+            return ready + [e for e in ranked if not caught_up(e)]
+        return ready
+
+    def _observe(self, endpoint, call, response):
+        """Learns endpoint heads and our write watermark from successful answers"""
+        result = response.get("result")
+        if call.block is not None:
+            endpoint.saw_block(call.block)
+        if call.method == "eth_blockNumber" and isinstance(result, str):
+            endpoint.saw_block(int(result, 16))
+        elif call.method == "eth_sendRawTransaction":
+            self._pinned_until = time.monotonic() + self.pin_after_write
+        elif call.method == "eth_getTransactionReceipt" and isinstance(result, dict) and result.get("blockNumber"):
+            block = result["blockNumber"]
+            block = int(block, 16) if isinstance(block, str) else int(block)
+            endpoint.saw_block(block)
+            with self._lock:
+                if self._write_block is None or block > self._write_block:
+                    self._write_block = block
+
+    # --- TRANSPORT ---
+    def _post(self, endpoint, calls):
+        """One request (or batch) to one endpoint; answers in call order, None if missing"""
+        with self._lock:
+            ids = list(range(self._next_id, self._next_id + len(calls)))
+            self._next_id += len(calls)
+        requests_ = [
+            {"jsonrpc": "2.0", "method": call.method, "params": call.params or [], "id": request_id}
+            for call, request_id in zip(calls, ids)
+        ]
+        payload = json.dumps(requests_[0] if len(calls) == 1 else requests_, default=str)
+        decoded = self.decode_rpc_response(endpoint.post(payload, self.timeout))
+        if len(calls) == 1:
+            return [decoded]
+        if not isinstance(decoded, list):
+            # The node rejected the whole batch (e.g. batching disabled): answer one by one
+            return [self._post(endpoint, [call])[0] for call in calls]
+        by_id = {response.get("id"): response for response in decoded}
+        return [by_id.get(request_id) for request_id in ids]
+
+    def _send(self, calls, endpoints):
+        """Sends calls, moving the ones that failed on an endpoint on to the next"""
+        responses = [None] * len(calls)
+        pending = list(range(len(calls)))
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                answers = self._post(endpoint, [calls[i] for i in pending])
+            except requests.RequestException as e:
+                last_error = e
+                continue
+            failed = []
+            for i, answer in zip(pending, answers):
+                if answer is not None:
+                    responses[i] = answer
+                if _retryable(answer):
+                    failed.append(i)
+                    if calls[i].block is not None and endpoint.head is not None and endpoint.head >= calls[i].block:
+                        endpoint.head = calls[i].block - 1  # it doesn't have that block after all
+                else:
+                    self._observe(endpoint, calls[i], answer)
+            pending = failed
+            if not pending:
+                break
+        if any(response is None for response in responses):
+            raise last_error or requests.ConnectionError("No endpoint answered the request")
+        # Anything still pending carries the last endpoint's error response
+        return responses
+
+    def is_connected(self, show_traceback=False):
+        try:
+            return "result" in self._send([_Call("web3_clientVersion", [])], [self.primary])[0]
+        except Exception:
+            if show_traceback:
+                raise
+            return False
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
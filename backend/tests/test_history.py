@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+import history
+
+# apply_rollups retry semantics against a collection that scripts its bulk_write outcomes.
+#   cd backend && python -m pytest tests
+
+
+class ScriptedRollups:
+    """bulk_write raises the next scripted duplicate-key indexes, then succeeds"""
+
+    def __init__(self, *duplicates):
+        self.duplicates = list(duplicates)
+        self.calls = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls.append([op._filter["_id"] for op in ops])
+        if self.duplicates:
+            indexes = self.duplicates.pop(0)
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": history.DUPLICATE_KEY} for i in indexes]})
+
+
+EVENTS = [
+    {"timestamp": datetime(2026, 1, 1, 10), "type": "MINT", "amount": 5},
+    {"timestamp": datetime(2026, 1, 1, 11), "type": "BURN", "amount": 2},
+]
+
+
+def test_lost_upsert_race_is_retried():
+    rollups = ScriptedRollups([1])  # another worker created the BURN document first
+    asyncio.run(history.apply_rollups(rollups, EVENTS, "batch-1"))
+    assert rollups.calls == [["2026-01-01:MINT", "2026-01-01:BURN"], ["2026-01-01:BURN"]]
+
+
+def test_duplicate_on_retry_means_batch_already_applied():
+    rollups = ScriptedRollups([0, 1], [0, 1])
+    asyncio.run(history.apply_rollups(rollups, EVENTS, "batch-1"))
+    assert len(rollups.calls) == 2
@@ -0,0 +1,161 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+from mongomock_motor import AsyncMongoMockClient
+
+import history_writer
+from history_writer import HistoryWriter, SEGMENT_SUFFIX, _encode
+
+# HistoryWriter crash recovery against an in-memory Mongo.
+#   cd backend && python -m pytest tests
+
+DEAD_PID = 999_999_999  # above pid_max on Linux, so never alive
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def write_journal(path, events):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(_encode(event), default=str) + "\n")
+
+
+def make_writer(tmp_path, collection, **kwargs):
+    return HistoryWriter(collection, journal_path=str(tmp_path / "history.journal"),
+                         flush_interval=60, fsync_interval=60, **kwargs)
+
+
+def leftover_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.startswith("history.journal"))
+
+
+def test_events_recorded_before_a_crash_are_replayed(tmp_path):
+    async def scenario():
+        collection = AsyncMongoMockClient().db.history
+        crashed = make_writer(tmp_path, collection)
+        ids = [crashed.record({"type": "MINT", "amount": i}) for i in range(3)]
+        crashed._journal.close()  # the process dies: no flush, no stop()
+
+        restarted = make_writer(tmp_path, collection)
+        await restarted.start()
+        await restarted.stop()
+        stored = [doc["_id"] async for doc in collection.find({}).sort("amount", 1)]
+        return ids, stored
+
+    ids, stored = run(scenario())
+    assert stored == ids
+    assert leftover_files(tmp_path) == []
+
+
+def test_journals_of_dead_workers_are_adopted(tmp_path):
+    base = tmp_path / "history.journal"
+    live = [{"_id": history_writer.ObjectId(), "type": "MINT", "amount": 1}]
+    segment = [{"_id": history_writer.ObjectId(), "type": "BURN", "amount": 2}]
+    write_journal(f"{base}.{DEAD_PID}", live)
+    write_journal(f"{base}.{DEAD_PID}.1700000000000.1{SEGMENT_SUFFIX}", segment)
+    # A journal from before journals were per process
+    legacy = [{"_id": history_writer.ObjectId(), "type": "LIST", "amount": 3}]
+    write_journal(str(base), legacy)
+
+    async def scenario():
+        collection = AsyncMongoMockClient().db.history
+        writer = make_writer(tmp_path, collection)
+        await writer.start()
+        await writer.stop()
+        return sorted([doc["amount"] async for doc in collection.find({})])
+
+    assert run(scenario()) == [1, 2, 3]
+    assert leftover_files(tmp_path) == []
+
+
+def test_journal_of_live_worker_is_left_alone(tmp_path):
+    base = tmp_path / "history.journal"
+    parent = os.getppid()
+    write_journal(f"{base}.{parent}", [{"_id": history_writer.ObjectId(), "type": "MINT", "amount": 1}])
+
+    async def scenario():
+        collection = AsyncMongoMockClient().db.history
+        writer = make_writer(tmp_path, collection)
+        await writer.start()
+        await writer.stop()
+        return await collection.count_documents({})
+
+    assert run(scenario()) == 0
+    assert leftover_files(tmp_path) == [f"history.journal.{parent}"]
+
+
+def test_reflushed_batch_is_not_duplicated(tmp_path):
+    async def scenario():
+        collection = AsyncMongoMockClient().db.history
+        applied = []
+
+        async def on_flushed(events, batch_id):
+            applied.append(batch_id)
+
+        writer = make_writer(tmp_path, collection, on_flushed=on_flushed)
+        for i in range(3):
+            writer.record({"type": "MINT", "amount": i})
+        # Crash after the insert reached Mongo but before the segment was deleted
+        batch, writer._buffer = writer._buffer, []
+        segment = writer._rotate_journal()
+        await collection.insert_many([dict(event) for event in batch])
+
+        restarted = make_writer(tmp_path, collection, on_flushed=on_flushed)
+        await restarted.start()
+        await restarted.stop()
+        return await collection.count_documents({}), applied, str(batch[0]["_id"]), segment
+
+    count, applied, batch_id, segment = run(scenario())
+    assert count == 3
+    # The hook sees the same batch_id on the re-flush, so it can skip the batch
+    assert applied == [batch_id]
+    assert not os.path.exists(segment)
+
+
+def test_failed_hook_keeps_segment_for_retry(tmp_path):
+    async def scenario():
+        collection = AsyncMongoMockClient().db.history
+        calls = []
+
+        async def on_flushed(events, batch_id):
+            calls.append(batch_id)
+            if len(calls) == 1:
+                raise RuntimeError("rollups unavailable")
+
+        writer = make_writer(tmp_path, collection, on_flushed=on_flushed)
+        writer.record({"type": "MINT", "amount": 1})
+        await writer.flush()
+        kept = leftover_files(tmp_path)
+        await writer.flush()
+        await writer.stop()
+        return kept, calls, await collection.count_documents({})
+
+    kept, calls, count = run(scenario())
+    assert any(name.endswith(SEGMENT_SUFFIX) for name in kept)
+    assert len(calls) == 2 and calls[0] == calls[1]
+    assert count == 1
+    assert leftover_files(tmp_path) == []
+
+
+def test_journal_is_fsynced_off_the_loop(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(history_writer.os, "fsync", lambda fd: synced.append(fd))
+
+    async def scenario():
+        writer = make_writer(tmp_path, AsyncMongoMockClient().db.history)
+        writer.record({"type": "MINT", "amount": 1})
+        await writer.sync()
+        await writer.sync()  # nothing new: no second fsync
+        first = len(synced)
+        await writer.flush()  # fsyncs the rotated segment before inserting
+        await writer.stop()
+        return first
+
+    assert run(scenario()) == 1
+    assert len(synced) == 2
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+from mongomock_motor import AsyncMongoMockClient
+
+import idempotency
+from idempotency import IdempotencyStore
+
+# IdempotencyStore against an in-memory Mongo.
+#   cd backend && python -m pytest tests
+# A retry may only re-run a handler that never broadcast a transaction.
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_store():
+    return IdempotencyStore(AsyncMongoMockClient().db.idempotency_keys,
+                            tx_status=lambda tx_hash: {"tx_hash": tx_hash, "state": "mined"})
+
+
+class Handler:
+    """Counts calls; broadcasts `tx_hash` (if given) and then fails or succeeds"""
+
+    def __init__(self, store, tx_hash=None, response=None, error=None):
+        self.store, self.tx_hash, self.response, self.error = store, tx_hash, response, error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.tx_hash:
+            await self.store.record_broadcast(self.tx_hash)
+        if self.error:
+            raise self.error
+        return self.response
+
+
+def test_completed_response_is_replayed():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, tx_hash="0xaa", response={"status": "LISTED"})
+        first = await store.run("k", "list", {}, handler)
+        second = await store.run("k", "list", {}, handler)
+        return first, second, handler.calls
+
+    first, second, calls = run(scenario())
+    assert first == second == {"status": "LISTED"}
+    assert calls == 1
+
+
+def test_failure_before_broadcast_is_retried():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, response={"status": "ERROR"})
+        await store.run("k", "list", {}, handler)
+        await store.run("k", "list", {}, handler)
+        return handler.calls
+
+    assert run(scenario()) == 2
+
+
+def test_error_after_broadcast_reports_the_transaction():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, tx_hash="0xaa", response={"status": "ERROR", "message": "receipt timeout"})
+        await store.run("k", "trade", {}, handler)
+        retry = await store.run("k", "trade", {}, handler)
+        return retry, handler.calls
+
+    retry, calls = run(scenario())
+    assert calls == 1
+    assert retry["status"] == "ALREADY_BROADCAST"
+    assert retry["transactions"] == [{"tx_hash": "0xaa", "state": "mined"}]
+    assert retry["first_response"]["message"] == "receipt timeout"
+
+
+def test_exception_after_broadcast_keeps_the_key():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, tx_hash="0xaa", error=RuntimeError("node went away"))
+        with pytest.raises(RuntimeError):
+            await store.run("k", "trade", {}, handler)
+        retry = await store.run("k", "trade", {}, handler)
+        return retry, handler.calls
+
+    retry, calls = run(scenario())
+    assert calls == 1
+    assert retry["status"] == "ALREADY_BROADCAST"
+
+
+def test_uncacheable_response_after_broadcast_is_not_rerun():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, tx_hash="0xaa", response={"blockchain_tx": None})
+        cacheable = lambda response: response.get("blockchain_tx") is not None
+        await store.run("k", "mint", {}, handler, cacheable=cacheable)
+        retry = await store.run("k", "mint", {}, handler, cacheable=cacheable)
+        return retry, handler.calls
+
+    retry, calls = run(scenario())
+    assert calls == 1
+    assert retry["status"] == "ALREADY_BROADCAST"
+
+
+def test_stale_claim_of_a_crashed_worker(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_PENDING_TIMEOUT", 60)
+    stale = datetime.utcnow() - timedelta(seconds=120)
+
+    async def scenario():
+        store = make_store()
+        # Crashed mid-request: one broadcast, the other before anything went out
+        await store.collection.insert_many([
+            {"_id": "trade:sent", "fingerprint": idempotency._fingerprint({}), "state": "pending",
+             "created_at": stale, "tx_hashes": ["0xaa"]},
+            {"_id": "trade:unsent", "fingerprint": idempotency._fingerprint({}), "state": "pending",
+             "created_at": stale},
+        ])
+        sent = Handler(store, response={"status": "TRADED"})
+        unsent = Handler(store, response={"status": "TRADED"})
+        return (await store.run("sent", "trade", {}, sent), sent.calls,
+                await store.run("unsent", "trade", {}, unsent), unsent.calls)
+
+    sent_response, sent_calls, unsent_response, unsent_calls = run(scenario())
+    assert sent_response["status"] == "ALREADY_BROADCAST" and sent_calls == 0
+    assert unsent_response == {"status": "TRADED"} and unsent_calls == 1
+
+
+def test_broadcasts_outside_a_keyed_request_are_not_recorded():
+    async def scenario():
+        store = make_store()
+        handler = Handler(store, tx_hash="0xaa", response={"status": "ERROR"})
+        await store.run(None, "trade", {}, handler)
+        return await store.collection.count_documents({})
+
+    assert run(scenario()) == 0
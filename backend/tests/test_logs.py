@@ -0,0 +1,42 @@
+import logging
+
+from logs import SamplingFilter
+
+# SamplingFilter decisions on hand-made records.
+#   cd backend && python -m pytest tests
+
+
+def record(level, msg, **extra):
+    rec = logging.LogRecord("carbon.marketplace", level, __file__, 1, msg, None, None)
+    rec.__dict__.update(extra)
+    return rec
+
+
+def test_warnings_are_never_sampled():
+    sampler = SamplingFilter(rates={"marketplace": 0.0}, limit=100)
+    assert all(sampler.filter(record(logging.WARNING, "Marketplace list error", error=str(i)))
+               for i in range(50))
+    assert sampler.sampled_out == 0
+
+
+def test_identical_warnings_are_rate_limited_with_a_summary():
+    sampler = SamplingFilter(rates={}, limit=3, window=60)
+    passed = [sampler.filter(record(logging.WARNING, "Marketplace list error", error="nonce too low"))
+              for _ in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert sampler.warnings_rate_limited == 7
+
+    # A different error under the same template is not throttled
+    assert sampler.filter(record(logging.WARNING, "Marketplace list error", error="insufficient funds"))
+
+    # Next window: the first record reports what was suppressed
+    sampler.window = 0
+    summary = record(logging.WARNING, "Marketplace list error", error="nonce too low")
+    assert sampler.filter(summary)
+    assert summary.suppressed == 7
+
+
+def test_errors_are_never_rate_limited():
+    sampler = SamplingFilter(rates={}, limit=1)
+    assert all(sampler.filter(record(logging.ERROR, "Minting error", error="boom")) for _ in range(20))
+    assert sampler.rate_limited == 0
@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("pytesseract")
+pytest.importorskip("pdf2image")
+
+from ocr_engine import best_match
+
+# Field selection on hand-built image_to_data output, no tesseract needed.
+#   cd backend && python -m pytest tests
+# The lines are those of the sample PDFs in backend/.
+
+
+def page(lines, confidences=None):
+    """image_to_data-shaped dict: one line per entry, words 20px apart"""
+    data = {key: [] for key in ("text", "conf", "left", "top", "width", "height",
+                                "block_num", "par_num", "line_num")}
+    for line_num, line in enumerate(lines, start=1):
+        for word_num, word in enumerate(line.split()):
+            data["text"].append(word)
+            data["conf"].append((confidences or {}).get(line, 90.0))
+            data["left"].append(20 * word_num)
+            data["top"].append(30 * line_num)
+            data["width"].append(18)
+            data["height"].append(20)
+            data["block_num"].append(1)
+            data["par_num"].append(1)
+            data["line_num"].append(line_num)
+    return data
+
+
+AUDIT_REPORT = [
+    "EMISSIONS SUMMARY:",
+    "- Scope 1 Emissions: 350.5 tons",
+    "- Scope 2 Emissions: 150.0 tons",
+    "- Scope 3 Emissions: 99.5 tons",
+    "TOTAL CARBON EMISSIONS: 600.0 tons",
+]
+
+
+def test_total_line_beats_more_confident_line_items():
+    confidences = {"- Scope 3 Emissions: 99.5 tons": 96.0, "TOTAL CARBON EMISSIONS: 600.0 tons": 71.0}
+    result = best_match([page(AUDIT_REPORT, confidences)], dpi=200)
+    assert (result.value, result.total) == (600.0, True)
+
+
+def test_total_on_a_later_page_still_wins():
+    items, total = AUDIT_REPORT[:4], AUDIT_REPORT[4:]
+    result = best_match([page(items), page(total, {total[0]: 40.0})], dpi=200)
+    assert (result.value, result.page) == (600.0, 2)
+
+
+def test_largest_figure_wins_when_no_line_says_total():
+    lines = [
+        "Manufacturing Plant: 450.0 tons",
+        "Supply Chain Logistics: 150.0 tons",
+        "Corporate Offices: 100.0 tons",
+        "Combined Footprint: 700.0 tons",
+    ]
+    result = best_match([page(lines, {"Corporate Offices: 100.0 tons": 99.0})], dpi=200)
+    assert result.value == 700.0
+
+
+def test_stronger_rule_beats_a_total():
+    lines = ["Verified Carbon Allowance: 500 tons", "Total Emissions Last Year: 900 tons"]
+    result = best_match([page(lines)], dpi=200)
+    assert (result.value, result.rule) == (500.0, "key_unit")
@@ -0,0 +1,318 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rpc_provider import MultiEndpointProvider
+
+# MultiEndpointProvider against fake JSON-RPC nodes on localhost.
+#   cd backend && python -m pytest tests
+
+
+class FakeNode:
+    """A JSON-RPC node answering from a dict of handlers; records every request it gets"""
+
+    def __init__(self, head=100, delay=0.0):
+        self.head = head
+        self.delay = delay
+        self.handlers = {
+            "eth_blockNumber": lambda params: hex(self.head),
+            "eth_call": self._call,
+            "eth_getBalance": lambda params: "0x1",
+            "eth_sendRawTransaction": lambda params: "0x" + "ab" * 32,
+            "eth_getTransactionReceipt": lambda params: {"blockNumber": hex(self.head), "status": "0x1"},
+        }
+        self.errors = {}       # method -> JSON-RPC error object to answer with
+        self.requests = []     # (method, params) per call
+        self.posts = 0         # HTTP requests (a batch counts once)
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._lock = threading.Lock()
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                payload = json.dumps(node.answer(body)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _call(self, params):
+        block = params[1] if len(params) > 1 else "latest"
+        if isinstance(block, str) and block.startswith("0x") and int(block, 16) > self.head:
+            raise LookupError("header not found")
+        return hex(self.head)
+
+    def _one(self, request):
+        method, params = request["method"], request.get("params", [])
+        self.requests.append((method, params))
+        if method in self.errors:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": self.errors[method]}
+        try:
+            return {"jsonrpc": "2.0", "id": request["id"], "result": self.handlers[method](params)}
+        except LookupError as e:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32000, "message": str(e)}}
+
+    def answer(self, body):
+        with self._lock:
+            self.posts += 1
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            time.sleep(self.delay)
+            if isinstance(body, list):
+                return [self._one(request) for request in body]
+            return self._one(body)
+        finally:
+            with self._lock:
+                self.concurrent -= 1
+
+    def methods(self):
+        return [method for method, _ in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(count, **kwargs):
+        started.extend(FakeNode(**kwargs) for _ in range(count))
+        return started
+
+    yield start
+    for node in started:
+        node.close()
+
+
+def make_provider(nodes, **kwargs):
+    provider = MultiEndpointProvider([node.url for node in nodes], **kwargs)
+    # Make the replica the preferred reader so routing decisions are visible
+    provider.endpoints[0].latency = 1.0
+    for endpoint in provider.endpoints[1:]:
+        endpoint.latency = 0.001
+    return provider
+
+
+def call_params(block="latest"):
+    return [{"to": "0x" + "11" * 20, "data": "0x70a08231"}, block]
+
+
+def test_reads_go_to_fastest_endpoint(nodes):
+    primary, replica = nodes(2)
+    provider = make_provider([primary, replica])
+
+    assert provider.make_request("eth_call", call_params())["result"] == hex(100)
+    assert replica.methods() == ["eth_call"]
+    assert primary.methods() == []
+
+
+def test_node_error_fails_over_to_next_endpoint(nodes):
+    primary, replica = nodes(2)
+    replica.errors["eth_call"] = {"code": -32000, "message": "missing trie node"}
+    provider = make_provider([primary, replica])
+
+    response = provider.make_request("eth_call", call_params())
+
+    assert response["result"] == hex(100)
+    assert replica.methods() == ["eth_call"]
+    assert primary.methods() == ["eth_call"]
+
+
+def test_revert_is_returned_without_failover(nodes):
+    primary, replica = nodes(2)
+    replica.errors["eth_call"] = {"code": 3, "message": "execution reverted: Not active", "data": "0x"}
+    provider = make_provider([primary, replica])
+
+    response = provider.make_request("eth_call", call_params())
+
+    assert response["error"]["code"] == 3
+    assert primary.methods() == []
+
+
+def test_error_from_every_endpoint_is_returned(nodes):
+    primary, replica = nodes(2)
+    for node in (primary, replica):
+        node.errors["eth_call"] = {"code": -32000, "message": "missing trie node"}
+    provider = make_provider([primary, replica])
+
+    response = provider.make_request("eth_call", call_params())
+
+    assert response["error"]["message"] == "missing trie node"
+
+
+def test_transport_error_fails_over_and_marks_endpoint_down(nodes):
+    primary, replica = nodes(2)
+    provider = make_provider([primary, replica])
+    replica.close()
+
+    assert provider.make_request("eth_call", call_params())["result"] == hex(100)
+    assert not provider.endpoints[1].healthy
+
+
+def test_block_pinned_read_goes_to_endpoint_that_has_the_block(nodes):
+    primary, replica = nodes(2)
+    replica.head = 90
+    provider = make_provider([primary, replica])
+    provider.make_request("eth_blockNumber", [])  # the replica reports head 90
+
+    provider.make_request("eth_call", call_params(hex(85)))
+    provider.make_request("eth_call", call_params(hex(95)))
+
+    assert replica.methods() == ["eth_blockNumber", "eth_call"]
+    assert primary.requests == [("eth_call", call_params(hex(95)))]
+
+
+def test_block_pinned_read_retries_elsewhere_when_replica_lacks_block(nodes):
+    primary, replica = nodes(2)
+    replica.head = 90
+    provider = make_provider([primary, replica])
+    provider.endpoints[1].saw_block(100)  # stale belief, e.g. the replica reorged
+
+    assert provider.make_request("eth_call", call_params(hex(95)))["result"] == hex(100)
+    assert replica.methods() == ["eth_call"] and primary.methods() == ["eth_call"]
+
+    # Now known to be behind 95: straight to the primary
+    provider.make_request("eth_call", call_params(hex(95)))
+    assert replica.methods() == ["eth_call"]
+    assert primary.methods() == ["eth_call", "eth_call"]
+
+
+def test_reads_stay_on_primary_right_after_a_write(nodes):
+    primary, replica = nodes(2)
+    provider = make_provider([primary, replica], pin_after_write=60)
+
+    provider.make_request("eth_sendRawTransaction", ["0x00"])
+    provider.make_request("eth_call", call_params())
+
+    assert primary.methods() == ["eth_sendRawTransaction", "eth_call"]
+    assert replica.methods() == []
+
+
+def test_latest_reads_wait_for_replica_to_reach_our_receipt(nodes):
+    primary, replica = nodes(2)
+    primary.head, replica.head = 120, 110
+    provider = make_provider([primary, replica], pin_after_write=0)
+
+    provider.make_request("eth_getTransactionReceipt", ["0x" + "ab" * 32])  # mined in 120
+
+    # The replica's head is unknown (or behind 120): reads go to the primary
+    provider.make_request("eth_call", call_params())
+    assert replica.methods() == []
+    assert primary.methods()[-1] == "eth_call"
+
+    # Once the replica is seen at 120 it serves reads again
+    replica.head = 120
+    provider.endpoints[1].saw_block(120)
+    provider.make_request("eth_call", call_params())
+    assert replica.methods() == ["eth_call"]
+
+
+def test_primary_reads_context(nodes):
+    primary, replica = nodes(2)
+    provider = make_provider([primary, replica])
+
+    with provider.primary_reads():
+        provider.make_request("eth_call", call_params())
+    provider.make_request("eth_getBalance", ["0x" + "11" * 20, "latest"])
+
+    assert primary.methods() == ["eth_call"]
+    assert replica.methods() == ["eth_getBalance"]
+
+
+def test_identical_concurrent_reads_are_coalesced(nodes):
+    (node,) = nodes(1, delay=0.2)
+    provider = MultiEndpointProvider([node.url])
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(provider.make_request("eth_blockNumber", [])))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [r["result"] for r in results] == [hex(100)] * 8
+    assert node.posts < 8
+
+
+def test_several_batches_in_flight(nodes):
+    (node,) = nodes(1, delay=0.2)
+    provider = MultiEndpointProvider([node.url], max_inflight_batches=4)
+    results = []
+
+    def read(i):
+        results.append(provider.make_request("eth_getBalance", ["0x" + f"{i:040x}", "latest"]))
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(16)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    assert len(results) == 16 and all("error" not in r for r in results)
+    assert node.max_concurrent > 1
+    # Four 200ms slots batch the 16 reads into a handful of round trips
+    assert elapsed < 1.5
+
+
+def test_batch_failover_retries_only_failed_calls(nodes):
+    primary, replica = nodes(2, delay=0.05)
+    replica.head = 90
+    provider = make_provider([primary, replica], max_inflight_batches=1)
+    provider.endpoints[1].saw_block(100)
+    results = {}
+
+    def read(block):
+        results[block] = provider.make_request("eth_call", call_params(hex(block)))
+
+    threads = [threading.Thread(target=read, args=(block,)) for block in (80, 85, 95)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {block: r["result"] for block, r in results.items()} == {80: hex(90), 85: hex(90), 95: hex(100)}
+    # Only the read for block 95 reached the primary
+    assert primary.requests == [("eth_call", call_params(hex(95)))]
+
+
+def test_sender_slots_are_all_released_under_load(nodes):
+    (node,) = nodes(1, delay=0.002)
+    provider = MultiEndpointProvider([node.url], max_inflight_batches=3, max_batch=2, batch_window=0.001)
+    errors = []
+
+    def reader(worker):
+        for i in range(25):
+            response = provider.make_request("eth_getBalance", ["0x" + f"{worker * 100 + i:040x}", "latest"])
+            if "error" in response:
+                errors.append(response)
+
+    threads = [threading.Thread(target=reader, args=(worker,)) for worker in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    assert provider._queue == []
+    assert provider._senders == 0